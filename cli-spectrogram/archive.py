@@ -0,0 +1,346 @@
+# GNU LESSER GENERAL PUBLIC LICENSE
+#    Version 2.1, February 1999
+#
+# See LICENSE
+#
+# Copyright (c) 2020 Caileigh F
+#
+# Woods Hole Oceanographic Institution
+# Author: Caileigh Fitzgerald
+# Email:  cfitzgerald@whoi.edu
+# Date:   03/04/2020
+#
+# File: archive.py
+#
+# Packs a directory of uldaq <epoch>.txt files into an archive store:
+#   index.json        -> channels, dtype and how many files/samples are committed
+#   index_<col>.bin   -> one append-only column per file attribute (epoch,
+#                        offset, length, per channel crc32, stem)
+#   channel_N.f32     -> every sample for channel N as little endian float32
+# Columns and channels are appended first and index.json is replaced last,
+# so readers only ever map what the header says is committed.
+#
+from common import read_data_file, data_file_stem, glob_data_files
+import os
+import json
+import zlib
+import numpy
+import argparse
+import pathlib
+
+archive_index='index.json'
+archive_dtype='<f4'
+archive_stem_bytes=32
+archive_columns={
+    'epoch': '<f8',
+    'offset': '<i8',
+    'length': '<i8',
+    'crc32': '<u4', # one per channel
+    'stem': 'S{}'.format(archive_stem_bytes),
+}
+
+class ArchiveEntry(object):
+    def __init__(self, archive, row):
+        super(ArchiveEntry, self).__init__()
+        self.archive = archive
+        self.row = row
+        self.name = archive.column('stem')[row].decode() + '.txt'
+        self.stem = data_file_stem(self)
+        self.epoch = float(archive.column('epoch')[row])
+        self.offset = int(archive.column('offset')[row])
+        self.length = int(archive.column('length')[row])
+
+    def __eq__(self, other):
+        return(isinstance(other, ArchiveEntry) and self.name == other.name)
+
+    def __ne__(self, other):
+        return(not self.__eq__(other))
+
+    def __lt__(self, other):
+        return(self.epoch < other.epoch)
+
+    def __hash__(self):
+        return(hash(self.name))
+
+    def __str__(self):
+        return('{}:{}'.format(self.archive.path, self.name))
+
+    @property
+    def num_channels(self):
+        return(self.archive.num_channels)
+
+    @property
+    def crc32(self):
+        return(self.archive.column('crc32')[self.row])
+
+    def read_channel(self, channel):
+        # slice of the memory mapped column, nothing is read until it's used
+        return(self.archive.channel(channel)[self.offset:self.offset+self.length])
+
+    def verify(self):
+        for channel, crc in enumerate(self.crc32):
+            if zlib.crc32(self.read_channel(channel).tobytes()) & 0xffffffff != crc:
+                return False
+        return True
+
+class ArchiveEntries(object):
+    # list-like view of the entries in epoch order, entries are made on demand
+    # so a long archive isn't copied every time the viewer looks for new files
+    def __init__(self, archive):
+        super(ArchiveEntries, self).__init__()
+        self.archive = archive
+        self.length = archive.num_files
+
+    def __len__(self):
+        return(self.length)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return([self[i] for i in range(*position.indices(self.length))])
+        if position < 0:
+            position += self.length
+        if position < 0 or position >= self.length:
+            raise IndexError('archive entry out of range')
+        return(ArchiveEntry(self.archive, self.archive.row(position)))
+
+    def __iter__(self):
+        for position in range(0, self.length):
+            yield self[position]
+
+    def index(self, entry):
+        if not isinstance(entry, ArchiveEntry) or entry.row >= self.length:
+            raise ValueError('{} is not in the archive'.format(entry))
+        return(self.archive.position(entry.row))
+
+class Archive(object):
+    def __init__(self, path):
+        super(Archive, self).__init__()
+        self.path = pathlib.Path(path)
+        self.num_channels = None
+        self.num_samples = 0
+        self.num_files = 0
+        self.maps = {}
+        self.columns = {}
+        self.order = None     # rows in epoch order, None while they're packed in order
+        self.positions = None # inverse of order
+        self.checked = 0      # rows already checked for epoch order
+        self.index_mtime = None
+        self.load()
+
+    @staticmethod
+    def is_archive(path):
+        return((pathlib.Path(path) / archive_index).is_file())
+
+    def index_path(self):
+        return(self.path / archive_index)
+
+    def column_path(self, name):
+        return(self.path / 'index_{}.bin'.format(name))
+
+    def channel_path(self, channel):
+        return(self.path / 'channel_{}.f32'.format(channel))
+
+    def load(self):
+        if not self.is_archive(self.path):
+            return
+        mtime = os.path.getmtime(str(self.index_path()))
+        if mtime == self.index_mtime:
+            return
+        with open(str(self.index_path())) as f:
+            index = json.load(f)
+        self.index_mtime = mtime
+        self.num_channels = index['num_channels']
+        self.num_samples = index['num_samples']
+        self.num_files = index['num_files']
+        # maps are sized when they are made, remap after the archive grows
+        self.maps = {}
+        self.columns = {}
+        self.check_order()
+
+    def check_order(self):
+        # only the rows added since the last look are checked
+        epochs = self.column('epoch')
+        first = max(min(self.checked, self.num_files)-1, 0)
+        self.checked = self.num_files
+        if self.order is None:
+            if not numpy.any(numpy.diff(epochs[first:]) < 0):
+                return
+        elif len(self.order) == self.num_files:
+            return
+        # a file was packed late, list entries by epoch instead of by row
+        self.order = numpy.argsort(epochs, kind='stable')
+        self.positions = None
+
+    def row(self, position):
+        if self.order is None:
+            return(position)
+        return(int(self.order[position]))
+
+    def position(self, row):
+        if self.order is None:
+            return(row)
+        if self.positions is None:
+            self.positions = numpy.argsort(self.order)
+        return(int(self.positions[row]))
+
+    def entries(self):
+        # reload if the converter appended files since we last looked
+        self.load()
+        return(ArchiveEntries(self))
+
+    def column(self, name):
+        if name not in self.columns:
+            shape = (self.num_files,)
+            if name == 'crc32':
+                shape = (self.num_files, self.num_channels or 0)
+            if self.num_files == 0:
+                # empty files can't be mapped
+                return(numpy.zeros(shape, dtype=archive_columns[name]))
+            self.columns[name] = numpy.memmap(str(self.column_path(name)),
+                dtype=archive_columns[name], mode='r', shape=shape)
+        return(self.columns[name])
+
+    def channel(self, channel):
+        if channel not in self.maps:
+            self.maps[channel] = numpy.memmap(str(self.channel_path(channel)),
+                dtype=archive_dtype, mode='r', shape=(self.num_samples,))
+        return(self.maps[channel])
+
+    def append(self, file):
+        samples = read_data_file(file).astype(archive_dtype)
+        if samples.shape[0] == 0:
+            # empty files (the DAQ hadn't started writing) aren't packed
+            return(0)
+        if self.num_channels is None:
+            self.num_channels = samples.shape[1]
+        elif samples.shape[1] != self.num_channels:
+            raise Exception(' *{} has {} channels, archive has {}'.format(file, samples.shape[1], self.num_channels))
+        stem = data_file_stem(file)
+        if len(stem.encode()) > archive_stem_bytes:
+            raise Exception(' *{} is too long a name for the archive'.format(file))
+
+        crc32 = []
+        for channel in range(0, self.num_channels):
+            column = numpy.ascontiguousarray(samples[:, channel])
+            with open(str(self.channel_path(channel)), 'ab') as f:
+                f.write(column.tobytes())
+            crc32.append(zlib.crc32(column.tobytes()) & 0xffffffff)
+
+        try:
+            epoch = float(stem)
+        except ValueError:
+            epoch = os.path.getmtime(str(file))
+        row = {'epoch': epoch, 'offset': self.num_samples, 'length': samples.shape[0],
+               'crc32': crc32, 'stem': stem.encode()}
+        for name, dtype in archive_columns.items():
+            with open(str(self.column_path(name)), 'ab') as f:
+                f.write(numpy.asarray(row[name], dtype=dtype).tobytes())
+        self.num_samples += samples.shape[0]
+        self.num_files += 1
+        self.maps = {}
+        self.columns = {}
+        return(samples.shape[0])
+
+    def save(self):
+        # the header is all that's rewritten, the columns were appended to already
+        index = {
+            'num_channels': self.num_channels,
+            'num_samples': self.num_samples,
+            'num_files': self.num_files,
+            'dtype': archive_dtype,
+            'columns': archive_columns,
+        }
+        # write then rename so viewers never see a half written index
+        tmp = self.path / (archive_index+'.tmp')
+        with open(str(tmp), 'w') as f:
+            json.dump(index, f)
+        os.rename(str(tmp), str(self.index_path()))
+
+    def truncate(self):
+        # drop samples and rows past the end of the index (left by an interrupted append),
+        # every channel file on disk is checked since a run that never saved left
+        # channels the index doesn't know about
+        sizes = []
+        for path in self.path.glob('channel_*.f32'):
+            try:
+                channel = int(path.stem.split('_', 1)[1])
+            except ValueError:
+                continue
+            committed = self.num_samples if channel < (self.num_channels or 0) else 0
+            sizes.append((path, committed*numpy.dtype(archive_dtype).itemsize))
+        for name, dtype in archive_columns.items():
+            width = (self.num_channels or 0) if name == 'crc32' else 1
+            sizes.append((self.column_path(name), self.num_files*width*numpy.dtype(dtype).itemsize))
+        for path, size in sizes:
+            if path.is_file() and os.path.getsize(str(path)) > size:
+                with open(str(path), 'r+b') as f:
+                    f.truncate(size)
+
+def convert(source, dest, include_newest=False, verbose=True):
+    dest = pathlib.Path(dest)
+    if not dest.is_dir():
+        dest.mkdir(parents=True)
+    archive = Archive(dest)
+    archive.truncate()
+    # by stem, so compressing a packed file doesn't pack it again
+    packed = set(stem.decode() for stem in archive.column('stem'))
+
+    files = glob_data_files(source)
+    # the newest file is most likely still being written by the DAQ
+    if not include_newest:
+        files = files[:-1]
+
+    count = 0
+    try:
+        for file in files:
+            stem = data_file_stem(file)
+            if stem in packed:
+                continue
+            if archive.append(file) == 0:
+                # left out of packed so it's picked up once it has samples
+                print(' skipped empty file: {}'.format(file.name))
+                continue
+            packed.add(stem)
+            count += 1
+            if verbose:
+                print(' packed: {}'.format(file.name))
+            # save as we go so an interrupted run keeps what it has done
+            if count%100 == 0:
+                archive.save()
+    except (Exception, KeyboardInterrupt):
+        # keep everything packed before the failure
+        if count > 0:
+            archive.save()
+        raise
+    if count > 0 or not Archive.is_archive(dest):
+        archive.save()
+    return(count)
+
+def verify(dest):
+    archive = Archive(dest)
+    bad = [entry.name for entry in archive.entries() if not entry.verify()]
+    for name in bad:
+        print(' checksum mismatch: {}'.format(name))
+    return(bad)
+
+def main():
+    parser = argparse.ArgumentParser(description='Pack uldaq text files into an indexed binary archive')
+    parser.add_argument('--source', help='Source directory with .txt files', required=False)
+    parser.add_argument('--dest', help='Archive directory (created if missing)', required=True)
+    parser.add_argument('--include-newest', help='Also pack the newest file', action='store_true')
+    parser.add_argument('--verify', help='Check the archive checksums instead of packing', action='store_true')
+    parser.add_argument('-q','--quiet', action='store_true', help='Only print a summary', required=False)
+    parser.set_defaults(source=os.getcwd())
+    args = parser.parse_args()
+
+    if args.verify:
+        bad = verify(args.dest)
+        print('{} bad file(s)'.format(len(bad)))
+        exit(1 if bad else 0)
+
+    count = convert(args.source, args.dest, include_newest=args.include_newest, verbose=not args.quiet)
+    print('packed {} new file(s) into {}'.format(count, args.dest))
+
+
+if __name__ == '__main__':
+    main()
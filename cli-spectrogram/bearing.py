@@ -0,0 +1,50 @@
+# GNU LESSER GENERAL PUBLIC LICENSE
+#    Version 2.1, February 1999
+#
+# See LICENSE
+#
+# Copyright (c) 2020 Caileigh F
+#
+# Woods Hole Oceanographic Institution
+# Author: Caileigh Fitzgerald
+# Email:  cfitzgerald@whoi.edu
+# Date:   03/04/2020
+#
+# File: bearing.py
+#
+# GCC-PHAT time difference of arrival between every pair of channels, computed
+# from the per-frame spectra the spectrogram already has, and a coarse bearing
+# for a uniform line array (channel N at N*spacing). Bearings are degrees from
+# broadside, positive when the sound reaches the higher channels first.
+#
+import numpy
+
+def channel_pairs(num_channels):
+    # every (i, j) with i < j
+    return(numpy.array(numpy.triu_indices(num_channels, k=1)).T)
+
+def gcc_phat(spectra, pairs, sample_rate, nfft, max_tdoa=None, interp=4):
+    # spectra (channels, frames, bins) -> tdoa (pairs, frames) in seconds and
+    # peak (pairs, frames) height of the PHAT weighted correlation (0..1)
+    cross = spectra[pairs[:, 0]] * numpy.conj(spectra[pairs[:, 1]])
+    cross /= numpy.maximum(numpy.abs(cross), 1e-20)
+    # zero padding the spectrum interpolates the correlation by interp
+    n = nfft*interp
+    cc = numpy.fft.irfft(cross, n=n, axis=-1)
+    max_shift = int(n/2)
+    if max_tdoa is not None:
+        max_shift = min(max_shift, max(1, int(numpy.ceil(max_tdoa*sample_rate*interp))))
+    # lags -max_shift..+max_shift
+    cc = numpy.concatenate((cc[..., -max_shift:], cc[..., :max_shift+1]), axis=-1)
+    shift = numpy.argmax(cc, axis=-1)
+    peak = numpy.take_along_axis(cc, shift[..., None], axis=-1)[..., 0]*n/float(2*cross.shape[-1]-1)
+    tdoa = (shift-max_shift)/float(sample_rate*interp)
+    return(tdoa, peak)
+
+def line_array_bearing(tdoa, peak, pairs, spacing, sound_speed):
+    # each pair gives sin(bearing), average them weighted by how sharp their peak was
+    baseline = (pairs[:, 1]-pairs[:, 0])*spacing
+    sin_theta = numpy.clip(tdoa*sound_speed/baseline[:, None], -1, 1)
+    weight = numpy.maximum(peak, 0)
+    total = numpy.maximum(weight.sum(axis=0), 1e-20)
+    return(numpy.degrees(numpy.arcsin((sin_theta*weight).sum(axis=0)/total)))
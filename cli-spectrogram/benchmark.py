@@ -0,0 +1,62 @@
+# GNU LESSER GENERAL PUBLIC LICENSE
+#    Version 2.1, February 1999
+#
+# See LICENSE
+#
+# Copyright (c) 2020 Caileigh F
+#
+# Woods Hole Oceanographic Institution
+# Author: Caileigh Fitzgerald
+# Email:  cfitzgerald@whoi.edu
+# Date:   03/04/2020
+#
+# File: benchmark.py
+#
+# Sustained spectral throughput for 1..N worker processes. Anything under
+# 1.0x real time means the display will fall behind the DAQ.
+#
+from spectra_pool import SpectraPool
+import time
+import numpy
+import argparse
+import multiprocessing
+
+def run(samples, nfft, workers, repeats):
+    pool = SpectraPool(workers)
+    try:
+        # first call sets up the workers and shared memory
+        pool.spectra_db(samples, nfft)
+        start = time.time()
+        for i in range(0, repeats):
+            pool.spectra_db(samples, nfft)
+        return((time.time()-start)/repeats)
+    finally:
+        pool.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the spectral stage against the number of workers')
+    parser.add_argument('--sample-rate', help='', required=False, type=float)
+    parser.add_argument('--file-length', help='in seconds', required=False, type=float)
+    parser.add_argument('--channels', help='', required=False, type=int)
+    parser.add_argument('--nfft', help='', required=False, type=int)
+    parser.add_argument('--max-workers', help='', required=False, type=int)
+    parser.add_argument('--repeats', help='Files timed per worker count', required=False, type=int)
+    parser.set_defaults(sample_rate=100000,
+                        file_length=1.0,
+                        channels=8,
+                        nfft=240,
+                        max_workers=multiprocessing.cpu_count(),
+                        repeats=10)
+    args = parser.parse_args()
+
+    samples = numpy.random.normal(0, 0.001, (args.channels, int(args.sample_rate*args.file_length)))
+    print('{} channel(s) x {} samples, nfft={}'.format(args.channels, samples.shape[1], args.nfft))
+    print(' workers | sec/file | Msamples/s | x real time')
+    for workers in range(1, args.max_workers+1):
+        elapsed = run(samples, args.nfft, workers, args.repeats)
+        print(' {:7d} | {:8.4f} | {:10.2f} | {:11.2f}'.format(workers, elapsed,
+            samples.size/elapsed/1e6, args.file_length/elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -12,8 +12,10 @@
 #
 # File: cli_spectrogram.py
 #
-from common import ConfigError, voltage_bar_width, default_console_height, menu_column_buffer, menu_row_buffer, extra_column_buffer, ESC, unix_epoch_to_local, config_curses
+from common import ConfigError, voltage_bar_width, default_console_height, menu_column_buffer, menu_row_buffer, extra_column_buffer, ESC, unix_epoch_to_local, config_curses, default_socket_path, data_file_stem
 from specgram import Specgram
+from ltsa import Ltsa
+from realtime import realtime_policies
 from ui import Ui
 import os
 import numpy
@@ -22,6 +24,7 @@ import argparse
 import pathlib
 import glob
 import time
+import socket
 import curses
 
 def handle_config(args):
@@ -37,18 +40,44 @@ def handle_config(args):
     return(args)
 
 def run_cli(source, sample_rate, file_length_sec, debug, 
-    display_channel, threshold_db, markfreq_hz, threshold_steps, nfft, device_name):
+    display_channel, threshold_db, markfreq_hz, threshold_steps, nfft, device_name, connect=None,
+    ltsa_period='file', ltsa_length=1440, ltsa_rows=8, shm=None, realtime=None,
+    array_spacing=1.0, sound_speed=1500.0):
     log_dir = source
-    if not os.path.isdir(log_dir):
+    client = None
+    ring = None
+    if shm is not None:
+        # samples come straight out of the DAQ's shared memory ring buffer
+        from shm_ring import ShmRingReader
+        try:
+            ring = ShmRingReader(shm)
+        except OSError as err:
+            print('Unable to attach to shared memory! shm=%s (%s)'%(str(shm), str(err)))
+            exit(2)
+        sample_rate = ring.sample_rate
+    elif connect is not None:
+        # spectra come from a running daemon, source is not read here
+        from daemon import SpecgramClient
+        try:
+            client = SpecgramClient(connect)
+        except socket.error as err:
+            print('Unable to connect to the daemon! socket=%s (%s)'%(str(connect), str(err)))
+            exit(2)
+    elif not os.path.isdir(log_dir):
         print('Must provide valid log directory! source=%s'%str(log_dir))
         exit(2)
 
     stdscr, curses = config_curses()
     console_height, console_width = stdscr.getmaxyx()
+    if client is not None:
+        # the daemon picks nfft, the layout has to fit its rows
+        client.wait_for_frame(stdscr)
+        nfft = client.header['nfft']
+        sample_rate = client.header['sample_rate']
     # setup dimensions for window
     columns_of_data = int(nfft/2)
     min_width = columns_of_data+extra_column_buffer
-    while min_width > console_width:
+    while min_width > console_width and client is None:
         nfft -= 10
         columns_of_data = int(nfft/2)
         min_width = columns_of_data+extra_column_buffer
@@ -63,17 +92,31 @@ def run_cli(source, sample_rate, file_length_sec, debug,
 
     # create Ui object
     ui = Ui(min_width, min_height, time.time(), curses.color_pair, max_rows_specgram, max_rows_specgram_no_menu, 
-        file_length_sec=file_length_sec, sample_rate=sample_rate)
+        file_length_sec=file_length_sec, sample_rate=sample_rate, ltsa_rows=ltsa_rows, 
+        realtime_policy=realtime)
+    if client is not None:
+        # NFFT keys can't change the daemon's spectra
+        ui.fixed_nfft = True
+        # ask for a wider terminal instead of shrinking nfft
+        ui.pending_resize = True
     # create specgram object 
     specgram = Specgram(sample_rate, file_length_sec, display_channel, 
         device_name=device_name, scale='dB', threshdb=threshold_db, threshdb_steps=threshold_steps, 
         markfreq=markfreq_hz, nfft=nfft, max_lines=ui.specgram_max_lines, color_pair=curses.color_pair, 
-        voltage_bar_width=voltage_bar_width)
+        voltage_bar_width=voltage_bar_width,
+        array_spacing=array_spacing, sound_speed=sound_speed)
+    # long-term spectral average, always collecting so it has history when shown
+    ltsa = Ltsa(period=ltsa_period, length=ltsa_length, rows=ltsa_rows)
 
     # now dow stuff
     try:
         count=0
-        latest_file = ui.get_file(stdscr, source)
+        if client is not None:
+            latest_file = pathlib.Path(client.header['file'])
+        elif ring is not None:
+            latest_file = ring.wait_for_window(stdscr, sample_rate*file_length_sec)
+        else:
+            latest_file = ui.get_file(stdscr, source)
         previous_file = latest_file
         is_dup = True 
         current_time = time.time()
@@ -90,7 +133,17 @@ def run_cli(source, sample_rate, file_length_sec, debug,
                         log_file.write(message)
                         previous_time = current_time
 
-            latest_file = ui.get_file(stdscr, source)
+            if client is not None:
+                # only the newest spectra matter, older frames are skipped
+                client.poll()
+                latest_file = pathlib.Path(client.header['file'])
+                ui.current_file = latest_file
+            elif ring is not None:
+                # the newest file_length_sec of samples, viewed in place
+                latest_file = ring.wait_for_window(stdscr, sample_rate*file_length_sec)
+                ui.current_file = latest_file
+            else:
+                latest_file = ui.get_file(stdscr, source)
             # 
             # if DAQ isn't running, new files aren't being added to the log dir
             # - Let user know they are looking at the specgram of the same file over and over
@@ -102,10 +155,24 @@ def run_cli(source, sample_rate, file_length_sec, debug,
                 is_dup = False
             previous_file = latest_file
 
+            # lag is measured from the file being finished to it being drawn
+            if client is not None:
+                ui.latency.count_frames(client.header['seq'], client.header['dropped'])
+                ui.latency.start(latest_file, client.header['arrival'])
+            else:
+                ui.latency.start(latest_file)
             # clear out data list
             specgram.clear()
-            # take the file and parse into specgram object
-            rc = specgram.parse_file(latest_file)
+            if client is not None:
+                if client.header['nfft'] != specgram.nfft:
+                    # the daemon was restarted with another nfft, refit the layout
+                    ui.min_width += int(client.header['nfft']/2) - int(specgram.nfft/2)
+                    ui.pending_resize = True
+                # threshold, marker and layout are still applied here
+                specgram.load_spectra(client.spectra, client.rms_voltages, client.header['nfft'], client.header['sample_rate'])
+            else:
+                # take the file and parse into specgram object
+                rc = specgram.parse_file(latest_file)
             # if rc == None:
             #     ui.message_buffer.append('Unable to read file...')
             #     # draw everything in the buffer 
@@ -115,6 +182,17 @@ def run_cli(source, sample_rate, file_length_sec, debug,
             stdscr.erase()
             try:
                 specgram.display(stdscr)
+                if not ui.stop_at_file:
+                    ui.latency.drawn(specgram)
+                # only new full band files in streaming mode go into the average
+                if not is_dup and not ui.stop_at_file and specgram.last_fdb is not None and specgram.zoom == 1:
+                    try:
+                        epoch = float(data_file_stem(latest_file))
+                    except ValueError:
+                        epoch = time.time()
+                    ltsa.add(specgram.last_fdb, specgram.nfft, specgram.display_channel, epoch)
+                if ui.show_ltsa:
+                    specgram.display_ltsa(stdscr, ltsa, ui.ltsa_pane_rows)
                 ui.update(stdscr, specgram, is_dup, count)
                 # spin ui will display menu and handle user inputs
                 stdscr, specgram = ui.spin(stdscr, specgram)
@@ -133,10 +211,19 @@ def run_cli(source, sample_rate, file_length_sec, debug,
         print('\n\tExiting...\n\n')
         exit(1)
 
+    except EOFError as err:
+        print('\n\tLost connection to the daemon: {}\n\n'.format(err))
+        exit(1)
+
     except ConfigError as err:
         pass
 
     finally:
+        if client is not None:
+            client.close()
+        if ring is not None:
+            specgram.clear()
+            ring.close()
         curses.nocbreak()
         stdscr.keypad(False)
         curses.echo()
@@ -156,12 +243,29 @@ def main():
     parser.add_argument('-m','--markfreq-hz', help='', required=False, type=int)
     parser.add_argument('--nfft', help='', required=False, type=int)
     parser.add_argument('--use-config', help='Use config file', action='store_true')    
+    parser.add_argument('--ltsa-period', help='Average one file or one minute into each LTSA row [L|l to show]', 
+                        required=False, choices=['file', 'minute'])
+    parser.add_argument('--ltsa-length', help='Number of averages the LTSA keeps', required=False, type=int)
+    parser.add_argument('--ltsa-rows', help='Rows used to draw the LTSA', required=False, type=int)
+    parser.add_argument('--shm', help='Read samples from this shared memory ring buffer instead of files', 
+                        required=False, default=None)
+    parser.add_argument('--realtime', help='When drawing falls behind: skip to the newest file, draw fewer rows or decimate frames', 
+                        required=False, default=None, choices=realtime_policies)
+    parser.add_argument('--array-spacing', help='Meters between hydrophones for bearings [G|g to show]', required=False, type=float)
+    parser.add_argument('--sound-speed', help='Speed of sound in m/s for bearings', required=False, type=float)
+    parser.add_argument('--connect', help='Render spectra from cli_spectrogram_daemon on this UNIX socket', 
+                        nargs='?', const=default_socket_path, default=None)
     parser.set_defaults(source=os.getcwd(), 
                         display_channel=0, 
                         threshold_db=90, 
                         markfreq_hz=5000, 
                         threshold_steps=5, 
                         nfft=240,
+                        array_spacing=1.0,
+                        sound_speed=1500.0,
+                        ltsa_period='file',
+                        ltsa_length=1440,
+                        ltsa_rows=8,
                         sample_rate=19200,
                         file_length=1.0)
     args = parser.parse_args()
@@ -178,7 +282,15 @@ def main():
                            args.markfreq_hz, 
                            args.threshold_steps, 
                            args.nfft,
-                           args.device_name))
+                           args.device_name,
+                           args.connect,
+                           args.ltsa_period,
+                           args.ltsa_length,
+                           args.ltsa_rows,
+                           args.shm,
+                           args.realtime,
+                           args.array_spacing,
+                           args.sound_speed))
 
 
 if __name__ == '__main__':
@@ -14,8 +14,17 @@
 #
 import time
 import curses
+import gzip
+import bz2
+import numpy
+import pathlib
+try:
+    import lzma
+except ImportError: # no xz support on this interpreter
+    lzma = None
 
-voltage_bar_width=0   # 22 for values and buffer of 1 on each side
+voltage_bar_width=22  # 22 for values and buffer of 1 on each side
+bearing_bar_width=24  # bearing label and -90..+90 degree bar
 extra_column_buffer=10 # need buffer of 10 columns for axis labels
 menu_row_buffer=13     # menu takes up 13 rows
 menu_column_buffer=115 # menu takes up about 110 columns
@@ -23,8 +32,18 @@ default_console_height=53 # resonable to expect 53 char height for console
 ESC=27
 ZOOM_IN=43  # +
 ZOOM_OUT=45 # -
+max_zoom=32
+zoom_taps_per_decimation=8 # anti-alias filter length, in multiples of the decimation
 SHIFT_UP=337
 SHIFT_DOWN=336
+param_coalesce_sec=0.25 # key repeats closer together than this are applied as one change
+complete_file_fraction=0.9 # skipped files at least this size of a complete one count as dropped
+default_socket_path='/tmp/cli_spectrogram.sock'
+data_chunk_size=1<<20  # read data files 1MiB at a time
+# compressed archives of the uldaq text files -> opener for each codec
+compression_openers={'.gz': gzip.open, '.bz2': bz2.open}
+if lzma is not None:
+    compression_openers['.xz'] = lzma.open
 
 class ConfigError(Exception):
     def __init__(self, key, value):
@@ -36,6 +55,81 @@ def unix_epoch_to_local(epoch, no_date=False):
         return(str(time.strftime('%Hhour%Mmin%Ssecond', time.localtime(epoch))))
     return(str(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(epoch))))
 
+def open_data_file(file):
+    # open plain or compressed data files as a text stream
+    for suffix, opener in compression_openers.items():
+        if str(file).endswith(suffix):
+            return(opener(str(file), 'rt'))
+    return(open(str(file)))
+
+def glob_data_files(source):
+    # plain and compressed files sort together by their epoch file names
+    files = list(pathlib.Path(source).glob('*.txt'))
+    for suffix in compression_openers:
+        files.extend(pathlib.Path(source).glob('*.txt{}'.format(suffix)))
+    return(sorted(files, key=data_file_stem))
+
+def data_file_stem(file):
+    # 1583190238.414831290.txt.gz -> 1583190238.414831290
+    name = file.name
+    for suffix in compression_openers:
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+            break
+    return(name.rsplit('.', 1)[0])
+
+def parse_block(text, num_channels=None):
+    # parse complete lines of comma separated voltages into a (samples, channels) array
+    lines = text.split('\n')
+    if num_channels is None:
+        num_channels = lines[0].count(',')+1
+    # fast path, every line has the same number of columns and parses as a float
+    if text.count(',') == (num_channels-1)*len(lines):
+        try:
+            values = numpy.array(text.replace('\n', ',').split(','), dtype=float)
+        except ValueError:
+            pass
+        else:
+            return(values.reshape(-1, num_channels), num_channels)
+    # slow path, skip lines that are empty, partially written or have bad data
+    rows = []
+    for line in lines:
+        voltages = line.split(',')
+        if len(voltages) != num_channels:
+            continue
+        try:
+            rows.append([float(v) for v in voltages])
+        except ValueError:
+            continue
+    return(numpy.array(rows, dtype=float).reshape(-1, num_channels), num_channels)
+
+def read_data_file(file, chunk_size=data_chunk_size):
+    # stream the file (decompressing on the fly) through the bulk parser in chunks
+    blocks = []
+    num_channels = None
+    remainder = ''
+    with open_data_file(file) as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            chunk = remainder + chunk
+            end = chunk.rfind('\n')
+            if end < 0:
+                remainder = chunk
+                continue
+            remainder = chunk[end+1:]
+            if end == 0:
+                continue
+            block, num_channels = parse_block(chunk[:end], num_channels)
+            blocks.append(block)
+    if remainder.strip():
+        block, num_channels = parse_block(remainder, num_channels)
+        blocks.append(block)
+    if len(blocks) == 0:
+        return(numpy.zeros((0, 1)))
+    return(numpy.concatenate(blocks))
+
 def config_curses():
     # start curses
     stdscr = curses.initscr()
@@ -0,0 +1,231 @@
+# GNU LESSER GENERAL PUBLIC LICENSE
+#    Version 2.1, February 1999
+#
+# See LICENSE
+#
+# Copyright (c) 2020 Caileigh F
+#
+# Woods Hole Oceanographic Institution
+# Author: Caileigh Fitzgerald
+# Email:  cfitzgerald@whoi.edu
+# Date:   03/04/2020
+#
+# File: daemon.py
+#
+# Runs the ingest and FFT once and publishes the spectra of every channel over
+# a local UNIX socket. cli_spectrogram --connect renders them, so each extra
+# viewer only pays for drawing. Every message is:
+#   4 byte big endian header length | JSON header | float32 payload
+#
+from common import read_data_file, default_socket_path
+from specgram import frame_rms
+from spectra_pool import SpectraPool
+from ui import Ui
+from realtime import file_arrival
+import os
+import json
+import time
+import numpy
+import select
+import curses
+import socket
+import struct
+import argparse
+
+def send_message(sock, header, payload=b''):
+    header = dict(header, payload=len(payload))
+    blob = json.dumps(header).encode('utf-8')
+    sock.sendall(struct.pack('!I', len(blob)) + blob + payload)
+
+def recv_exactly(sock, size):
+    buf = b''
+    while len(buf) < size:
+        chunk = sock.recv(size-len(buf))
+        if not chunk:
+            raise EOFError('daemon closed the connection')
+        buf += chunk
+    return(buf)
+
+def recv_message(sock):
+    (size,) = struct.unpack('!I', recv_exactly(sock, 4))
+    header = json.loads(recv_exactly(sock, size).decode('utf-8'))
+    payload = recv_exactly(sock, header['payload'])
+    return(header, payload)
+
+def read_samples(file):
+    # all channels of a file as (channels, samples)
+    if hasattr(file, 'read_channel'):
+        return(numpy.stack([file.read_channel(c) for c in range(0, file.num_channels)]))
+    return(read_data_file(file).T)
+
+class SpecgramDaemon(object):
+    def __init__(self, socket_path, source, sample_rate, file_length_sec, nfft, mode='text', workers=1):
+        super(SpecgramDaemon, self).__init__()
+        self.socket_path = socket_path
+        self.source = source
+        self.sample_rate = sample_rate
+        self.file_length_sec = file_length_sec
+        self.nfft = nfft
+        self.pool = SpectraPool(workers)
+        # the viewer's file picking logic, without a curses window
+        self.ui = Ui(0, 0, time.time(), None, 0, 0, sample_rate, mode=mode, file_length_sec=file_length_sec)
+        self.clients = []
+        self.last_file = None
+        self.last_frame = None
+        self.seq = 0 # frames published, viewers count the gaps as dropped
+        self.listener = None
+
+    def listen(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.socket_path)
+        self.listener.listen(8)
+
+    def compute(self, file):
+        samples = read_samples(file)
+        num_samples = int(self.sample_rate*self.file_length_sec)
+        fdb = self.pool.spectra_db(samples, self.nfft, num_samples).astype('<f4')
+        rms = frame_rms(samples, self.nfft, fdb.shape[1]).astype('<f4')
+        try:
+            arrival = file_arrival(file, self.file_length_sec)
+        except OSError: # file was removed from under us
+            arrival = time.time()
+        self.seq += 1
+        header = {
+            'file': file.name,
+            'arrival': arrival,
+            'seq': self.seq,
+            'dropped': self.ui.latency.dropped,
+            'nfft': self.nfft,
+            'sample_rate': self.sample_rate,
+            'shape': list(fdb.shape),
+        }
+        # payload is the dB spectra followed by the RMS voltage of every frame
+        return(header, fdb.tobytes() + rms.tobytes())
+
+    def publish(self, frame):
+        self.last_frame = frame
+        for client in list(self.clients):
+            self.send(client, frame)
+
+    def send(self, client, frame):
+        try:
+            send_message(client, *frame)
+        except (socket.error, socket.timeout):
+            # slow or gone viewers are dropped, they can reconnect
+            self.drop(client)
+
+    def drop(self, client):
+        if client in self.clients:
+            self.clients.remove(client)
+        client.close()
+
+    def poll_source(self):
+        if len(self.ui.get_files(self.source)) <= 2:
+            return
+        file = self.ui.get_file(None, self.source)
+        if file != self.last_file:
+            self.last_file = file
+            self.publish(self.compute(file))
+
+    def serve_forever(self):
+        self.listen()
+        next_poll = time.time()
+        try:
+            while True:
+                timeout = max(0, next_poll-time.time())
+                readable, _, _ = select.select([self.listener]+self.clients, [], [], timeout)
+                for sock in readable:
+                    if sock is self.listener:
+                        client, _ = self.listener.accept()
+                        client.settimeout(self.file_length_sec)
+                        self.clients.append(client)
+                        # new viewers get the latest spectra right away
+                        if self.last_frame is not None:
+                            self.send(client, self.last_frame)
+                    elif not sock.recv(4096):
+                        self.drop(sock)
+                if time.time() >= next_poll:
+                    next_poll = time.time()+self.file_length_sec
+                    self.poll_source()
+        finally:
+            for client in list(self.clients):
+                self.drop(client)
+            self.listener.close()
+            os.unlink(self.socket_path)
+            self.pool.close()
+
+class SpecgramClient(object):
+    def __init__(self, socket_path):
+        super(SpecgramClient, self).__init__()
+        self.socket_path = socket_path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socket_path)
+        self.header = None
+        self.spectra = None
+        self.rms_voltages = None
+
+    def poll(self, timeout=0):
+        # read everything that's waiting and keep only the newest spectra
+        got_frame = False
+        while select.select([self.sock], [], [], timeout)[0]:
+            header, payload = recv_message(self.sock)
+            self.header = header
+            values = numpy.frombuffer(payload, dtype='<f4')
+            size = int(numpy.prod(header['shape']))
+            self.spectra = values[:size].reshape(header['shape'])
+            self.rms_voltages = values[size:].reshape(header['shape'][:2])
+            got_frame = True
+            timeout = 0
+        return(got_frame)
+
+    def wait_for_frame(self, window):
+        while self.header is None:
+            window.erase()
+            window.addstr('Waiting for spectra from the daemon!\n', curses.A_BOLD)
+            window.addstr('----------------------------------------------\n')
+            window.addstr('Socket:  %s\n'%(str(self.socket_path)))
+            window.addstr('----------------------------------------------\n')
+            window.addstr('Hit Ctrl + C to Exit or wait for the daemon\n', curses.A_BOLD)
+            window.refresh()
+            self.poll(timeout=1)
+
+    def close(self):
+        self.sock.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Compute spectra once and serve them to cli_spectrogram viewers')
+    parser.add_argument('--sample-rate', help='', required=False, type=float)
+    parser.add_argument('--file-length', help='in seconds', required=False, type=float)
+    parser.add_argument('--source', help='Source directory with .txt files', required=False)
+    parser.add_argument('--socket', help='UNIX socket viewers connect to', required=False)
+    parser.add_argument('--nfft', help='', required=False, type=int)
+    parser.add_argument('--workers', help='Processes used for the FFT (1 runs it inline)', required=False, type=int)
+    parser.add_argument('--use-config', help='Use config file', action='store_true')
+    parser.set_defaults(source=os.getcwd(),
+                        workers=1,
+                        socket=default_socket_path,
+                        nfft=240,
+                        sample_rate=19200,
+                        file_length=1.0,
+                        mode='text')
+    args = parser.parse_args()
+
+    if args.use_config:
+        from cli_spectrogram import handle_config
+        args = handle_config(args)
+
+    if not os.path.isdir(args.source):
+        print('Must provide valid log directory! source=%s'%str(args.source))
+        exit(2)
+
+    daemon = SpecgramDaemon(args.socket, args.source, args.sample_rate, args.file_length, args.nfft, mode=args.mode, workers=args.workers)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        print('\n\tExiting...\n\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+# GNU LESSER GENERAL PUBLIC LICENSE
+#    Version 2.1, February 1999
+#
+# See LICENSE
+#
+# Copyright (c) 2020 Caileigh F
+#
+# Woods Hole Oceanographic Institution
+# Author: Caileigh Fitzgerald
+# Email:  cfitzgerald@whoi.edu
+# Date:   03/04/2020
+#
+# File: ltsa.py
+#
+# Long-term spectral average. Each new file's spectra are folded into running
+# per-bin sums; when the period (one file or one minute) ends the average is
+# pushed into a fixed size ring buffer, so hours of history never get reread.
+#
+import numpy
+
+class Ltsa(object):
+    def __init__(self, period='file', length=1440, rows=8):
+        super(Ltsa, self).__init__()
+        self.period = period
+        self.length = length
+        self.rows = rows
+        self.reset()
+
+    def reset(self, nfft=None, channel=None):
+        self.nfft = nfft
+        self.channel = channel
+        self.buffer = None       # (length, bins) average linear power per period
+        self.epochs = numpy.zeros(self.length)
+        self.head = 0            # next slot to write
+        self.count = 0           # slots filled
+        self.acc = None          # running power sum for the current period
+        self.acc_frames = 0
+        self.acc_epoch = None
+        self.acc_key = None
+
+    def period_key(self, epoch):
+        if self.period == 'minute':
+            return(int(epoch // 60))
+        return(epoch)
+
+    def add(self, fdb, nfft, channel, epoch):
+        # a different NFFT or channel can't be averaged with what we have
+        if nfft != self.nfft or channel != self.channel:
+            self.reset(nfft, channel)
+        if len(fdb) == 0:
+            return
+
+        key = self.period_key(epoch)
+        if self.acc_key is not None and key != self.acc_key:
+            self.flush()
+        power = numpy.sum(numpy.power(10.0, numpy.asarray(fdb)/10.0), axis=0)
+        if self.acc is None:
+            self.acc = numpy.zeros(len(power))
+            self.acc_epoch = epoch
+        self.acc += power
+        self.acc_frames += len(fdb)
+        self.acc_key = key
+        if self.period == 'file':
+            self.flush()
+
+    def flush(self):
+        if self.acc is None or self.acc_frames == 0:
+            return
+        if self.buffer is None:
+            self.buffer = numpy.zeros((self.length, len(self.acc)))
+        self.buffer[self.head] = self.acc/self.acc_frames
+        self.epochs[self.head] = self.acc_epoch
+        self.head = (self.head+1) % self.length
+        self.count = min(self.count+1, self.length)
+        self.acc = None
+        self.acc_frames = 0
+        self.acc_epoch = None
+        self.acc_key = None
+
+    def columns(self):
+        # averages oldest to newest as (epochs, power)
+        if self.count == 0:
+            return(numpy.zeros(0), numpy.zeros((0, 0)))
+        order = (numpy.arange(self.count) + self.head - self.count) % self.length
+        return(self.epochs[order], self.buffer[order])
+
+    def compressed(self, rows):
+        # squeeze the whole history into at most rows lines, averaging in power
+        (epochs, power) = self.columns()
+        if len(power) > rows:
+            groups = numpy.array_split(numpy.arange(len(power)), rows)
+            epochs = numpy.array([epochs[g[0]] for g in groups])
+            power = numpy.array([power[g].mean(axis=0) for g in groups])
+        return(epochs, 10*numpy.log10(numpy.maximum(power, 1.0)))
@@ -0,0 +1,111 @@
+# GNU LESSER GENERAL PUBLIC LICENSE
+#    Version 2.1, February 1999
+#
+# See LICENSE
+#
+# Copyright (c) 2020 Caileigh F
+#
+# Woods Hole Oceanographic Institution
+# Author: Caileigh Fitzgerald
+# Email:  cfitzgerald@whoi.edu
+# Date:   03/04/2020
+#
+# File: realtime.py
+#
+# Keeps track of how stale the display is. Lag is the time from a file being
+# finished (its mtime, or the time of its last sample) to its spectrogram
+# being drawn. When parsing and drawing take longer than a file's length the
+# policy trades resolution for keeping up:
+#   skip     -> always jump to the newest file (count what was skipped)
+#   rows     -> draw fewer spectrogram rows
+#   decimate -> only FFT every 2nd, 4th or 8th frame
+#
+import os
+import time
+
+realtime_policies=['skip', 'rows', 'decimate']
+max_degrade_level=3   # at most 1/8 of the rows or frames
+recover_cycles=5      # cycles well under budget before resolution comes back
+
+def file_arrival(file, file_length_sec):
+    if hasattr(file, 'read_channel'):
+        # archive entries and shared memory windows carry their own epoch
+        try:
+            epoch = float(file.stem)
+        except ValueError:
+            return(time.time())
+        if hasattr(file, 'epoch'):
+            # archive entries are named for their first sample, not their last
+            epoch += file_length_sec
+        return(epoch)
+    return(os.path.getmtime(str(file)))
+
+class LatencyBudget(object):
+    def __init__(self, budget_sec, policy=None):
+        super(LatencyBudget, self).__init__()
+        self.budget_sec = budget_sec
+        self.policy = policy
+        self.level = 0
+        self.under_budget = 0
+        self.arrival = None
+        self.work_start = None
+        self.lag = 0.0
+        self.work = 0.0
+        self.dropped = 0
+        self.incomplete = 0 # short files that were skipped on purpose
+        self.last_seq = None
+        self.last_remote_dropped = 0
+
+    def start(self, file, arrival=None):
+        self.work_start = time.time()
+        if arrival is not None:
+            # --connect, the daemon timed the file where it was read
+            self.arrival = arrival
+            return
+        try:
+            self.arrival = file_arrival(file, self.budget_sec)
+        except OSError: # file was removed from under us
+            self.arrival = self.work_start
+
+    def count_frames(self, seq, remote_dropped):
+        # --connect, frames the daemon sent that were never drawn plus the
+        # files the daemon itself skipped
+        if self.last_seq is not None and seq >= self.last_seq:
+            self.dropped += max(0, seq - self.last_seq - 1)
+            self.dropped += max(0, remote_dropped - self.last_remote_dropped)
+        # a restarted daemon starts counting again
+        self.last_seq = seq
+        self.last_remote_dropped = remote_dropped
+
+    def drawn(self, specgram):
+        now = time.time()
+        self.lag = now - self.arrival
+        self.work = now - self.work_start
+        if self.policy is None or self.policy == 'skip':
+            return
+        # parse + fft + draw has to fit in one file length to keep up
+        if self.work > self.budget_sec:
+            self.level = min(self.level+1, max_degrade_level)
+            self.under_budget = 0
+        elif self.work < self.budget_sec/2.0 and self.level > 0:
+            self.under_budget += 1
+            if self.under_budget >= recover_cycles:
+                self.level -= 1
+                self.under_budget = 0
+        self.apply(specgram)
+
+    def apply(self, specgram):
+        step = 2**self.level
+        if self.policy == 'rows' and specgram.row_step != step:
+            specgram.row_step = step
+            specgram.calc_line_mod = True
+        elif self.policy == 'decimate':
+            specgram.frame_step = step
+
+    def status(self):
+        msg = 'lag: {:.2f}s dropped: {}'.format(self.lag, self.dropped)
+        if self.incomplete > 0:
+            msg += ' incomplete: {}'.format(self.incomplete)
+        if self.level > 0:
+            msg += ' [{} 1/{}]'.format(self.policy, 2**self.level)
+        return(msg)
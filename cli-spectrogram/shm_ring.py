@@ -0,0 +1,198 @@
+# GNU LESSER GENERAL PUBLIC LICENSE
+#    Version 2.1, February 1999
+#
+# See LICENSE
+#
+# Copyright (c) 2020 Caileigh F
+#
+# Woods Hole Oceanographic Institution
+# Author: Caileigh Fitzgerald
+# Email:  cfitzgerald@whoi.edu
+# Date:   03/04/2020
+#
+# File: shm_ring.py
+#
+# Shared memory ring buffer between a DAQ process on the same machine and
+# cli_spectrogram, so samples never go through ASCII files. Layout:
+#   header (64 bytes) -> magic, version, channels, capacity, sample rate,
+#                        epoch of sample 0, write index (total samples written)
+#   data             -> float32 (channels, 2*capacity)
+# Every sample is written twice, at i%capacity and i%capacity+capacity, so
+# the newest capacity samples of a channel are always one contiguous slice.
+#
+import time
+import numpy
+import struct
+import argparse
+try:
+    from multiprocessing import shared_memory
+except ImportError: # python < 3.8
+    shared_memory = None
+
+shm_magic=b'CLSG'
+shm_version=1
+shm_header_format='<4sIIQdd'
+shm_write_index_offset=40
+shm_header_size=64
+
+def attach(name, create=False, size=0):
+    if shared_memory is None:
+        raise Exception(' *shared memory sources need python 3.8 or newer')
+    if create:
+        return(shared_memory.SharedMemory(name=name, create=True, size=size))
+    try:
+        return(shared_memory.SharedMemory(name=name, track=False))
+    except TypeError:
+        # before 3.13 attaching registers the segment to be unlinked at exit
+        shm = shared_memory.SharedMemory(name=name)
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return(shm)
+
+class ShmWindow(object):
+    def __init__(self, ring, start, length):
+        super(ShmWindow, self).__init__()
+        self.ring = ring
+        self.start = start
+        self.length = length
+        epoch = ring.start_epoch + (start+length)/float(ring.sample_rate)
+        # looks like a data file name so the legend can show its time
+        self.name = '{:.6f}.shm'.format(epoch)
+        self.stem = '{:.6f}'.format(epoch)
+
+    def __eq__(self, other):
+        return(isinstance(other, ShmWindow) and (self.start, self.length) == (other.start, other.length))
+
+    def __ne__(self, other):
+        return(not self.__eq__(other))
+
+    def __hash__(self):
+        return(hash((self.start, self.length)))
+
+    @property
+    def num_channels(self):
+        return(self.ring.channels)
+
+    def read_channel(self, channel):
+        # a view straight into shared memory, nothing is copied
+        pos = self.start % self.ring.capacity
+        return(self.ring.data[channel, pos:pos+self.length])
+
+class ShmRing(object):
+    def __init__(self, shm):
+        super(ShmRing, self).__init__()
+        self.shm = shm
+        (magic, version, self.channels, self.capacity, self.sample_rate,
+            self.start_epoch) = struct.unpack_from(shm_header_format, shm.buf, 0)
+        if magic != shm_magic or version != shm_version:
+            raise Exception(' *{} is not a cli-spectrogram ring buffer'.format(shm.name))
+        self.index = numpy.ndarray((1,), dtype='<u8', buffer=shm.buf, offset=shm_write_index_offset)
+        self.data = numpy.ndarray((self.channels, 2*self.capacity), dtype='<f4',
+            buffer=shm.buf, offset=shm_header_size)
+
+    @property
+    def write_index(self):
+        return(int(self.index[0]))
+
+    def close(self):
+        self.index = None
+        self.data = None
+        try:
+            self.shm.close()
+        except BufferError: # a window is still being displayed
+            pass
+
+class ShmRingReader(ShmRing):
+    def __init__(self, name):
+        super(ShmRingReader, self).__init__(attach(name))
+
+    def latest(self, num_samples):
+        # newest num_samples of every channel, None until that many were written
+        num_samples = min(int(num_samples), self.capacity)
+        end = self.write_index
+        if end < num_samples:
+            return(None)
+        return(ShmWindow(self, end-num_samples, num_samples))
+
+    def wait_for_window(self, window, num_samples):
+        latest = self.latest(num_samples)
+        while latest is None:
+            window.erase()
+            window.addstr('Waiting for samples in shared memory!\n')
+            window.addstr('----------------------------------------------\n')
+            window.addstr('Ring buffer:  %s\n'%(str(self.shm.name)))
+            window.addstr('Samples:      %i/%i\n'%(self.write_index, int(num_samples)))
+            window.addstr('----------------------------------------------\n')
+            window.addstr('Hit Ctrl + C to Exit or start the DAQ\n')
+            window.refresh()
+            time.sleep(0.1)
+            latest = self.latest(num_samples)
+        return(latest)
+
+class ShmRingWriter(ShmRing):
+    def __init__(self, name, channels, sample_rate, capacity, start_epoch=None):
+        size = shm_header_size + channels*2*capacity*4
+        shm = attach(name, create=True, size=size)
+        if start_epoch is None:
+            start_epoch = time.time()
+        struct.pack_into(shm_header_format, shm.buf, 0, shm_magic, shm_version,
+            channels, capacity, sample_rate, start_epoch)
+        struct.pack_into('<Q', shm.buf, shm_write_index_offset, 0)
+        super(ShmRingWriter, self).__init__(shm)
+
+    def write(self, block):
+        # block is (channels, samples), the index only moves once both copies are in
+        block = numpy.asarray(block, dtype='<f4')
+        for offset in range(0, block.shape[1], self.capacity):
+            part = block[:, offset:offset+self.capacity]
+            num = part.shape[1]
+            pos = self.write_index % self.capacity
+            self.data[:, pos:pos+num] = part
+            first = min(num, self.capacity-pos)
+            self.data[:, pos+self.capacity:pos+self.capacity+first] = part[:, :first]
+            self.data[:, 0:num-first] = part[:, first:]
+            self.index[0] = self.write_index + num
+
+    def unlink(self):
+        self.close()
+        self.shm.unlink()
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate a DAQ writing tones and noise into a shared memory ring buffer')
+    parser.add_argument('--name', help='Name of the shared memory block', required=False)
+    parser.add_argument('--sample-rate', help='', required=False, type=float)
+    parser.add_argument('--channels', help='', required=False, type=int)
+    parser.add_argument('--capacity', help='Seconds of samples kept in the ring', required=False, type=float)
+    parser.add_argument('--block', help='Seconds of samples written at a time', required=False, type=float)
+    parser.add_argument('--tone-hz', help='Tone frequency, each channel is offset by 500Hz', required=False, type=float)
+    parser.set_defaults(name='cli_spectrogram',
+                        sample_rate=19200,
+                        channels=1,
+                        capacity=10.0,
+                        block=0.1,
+                        tone_hz=2000.0)
+    args = parser.parse_args()
+
+    writer = ShmRingWriter(args.name, args.channels, args.sample_rate, int(args.capacity*args.sample_rate))
+    block_len = int(args.block*args.sample_rate)
+    freqs = args.tone_hz + 500.0*numpy.arange(args.channels)
+    print('writing {} channel(s) at {}Hz into shared memory "{}", Ctrl + C to stop'.format(
+        args.channels, args.sample_rate, args.name))
+    try:
+        next_block = time.time()
+        while True:
+            t = (writer.write_index + numpy.arange(block_len))/float(args.sample_rate)
+            block = 0.002*numpy.sin(2*numpy.pi*freqs[:, None]*t[None, :])
+            block += numpy.random.normal(0, 0.0005, block.shape)
+            writer.write(block)
+            # keep pace with a real DAQ
+            next_block += args.block
+            time.sleep(max(0, next_block-time.time()))
+    except KeyboardInterrupt:
+        print('\n\tExiting...\n\n')
+    finally:
+        writer.unlink()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+# GNU LESSER GENERAL PUBLIC LICENSE
+#    Version 2.1, February 1999
+#
+# See LICENSE
+#
+# Copyright (c) 2020 Caileigh F
+#
+# Woods Hole Oceanographic Institution
+# Author: Caileigh Fitzgerald
+# Email:  cfitzgerald@whoi.edu
+# Date:   03/04/2020
+#
+# File: simulator.py
+#
+# Stands in for the DAQ when there's no hardware. Writes uldaq style text
+# files into a directory in real time, a block at a time like the DAQ does,
+# and keeps a ground truth log of when every file was finished:
+#   file, start epoch, finished epoch, samples written, status
+# where status is complete, partial (the DAQ stopped writing it early) or
+# dropout (no file at all for that period). With --measure a headless viewer
+# picks files with the same Ui.get_file logic as cli_spectrogram and reports
+# how long each file took to show up and which ones were never shown.
+#
+from ui import Ui
+from common import read_data_file
+from specgram import frame_spectra, spectra_db
+import os
+import time
+import numpy
+import pathlib
+import argparse
+import multiprocessing
+
+truth_columns=['file', 'start_epoch', 'finished_epoch', 'samples', 'status']
+
+def parse_list(text, cast=float, sep=','):
+    if not text:
+        return([])
+    return([cast(value) for value in text.split(sep)])
+
+class SignalGenerator(object):
+    def __init__(self, sample_rate, channels, tones=None, chirp=None, chirp_period=1.0, amplitude=0.002,
+        noise=0.0005, source_noise=0.0, bearing=None, array_spacing=1.0, sound_speed=1500.0):
+        super(SignalGenerator, self).__init__()
+        self.sample_rate = float(sample_rate)
+        self.channels = channels
+        self.tones = numpy.asarray(tones or [], dtype=float)
+        self.chirp = chirp # (start Hz, end Hz) or None
+        self.chirp_period = chirp_period
+        self.amplitude = amplitude
+        self.noise = noise
+        self.source_noise = source_noise
+        # plane wave from bearing degrees off broadside of a line array
+        self.delays = numpy.zeros(channels)
+        if bearing is not None:
+            self.delays = -numpy.arange(channels)*array_spacing*numpy.sin(numpy.radians(bearing))/sound_speed
+        # broadband source noise reaches each channel this many samples late,
+        # the last few source samples are kept so blocks join up
+        self.lags = (self.delays-self.delays.min())*self.sample_rate
+        self.history = numpy.zeros(int(numpy.ceil(self.lags.max()))+2)
+        self.rng = numpy.random.default_rng()
+
+    def block(self, first, length):
+        # samples first..first+length of every channel -> (length, channels)
+        t = (first + numpy.arange(length))/self.sample_rate
+        t = t[:, None] - self.delays[None, :]
+        block = numpy.zeros(t.shape)
+        for freq in self.tones:
+            block += self.amplitude*numpy.sin(2*numpy.pi*freq*t)
+        if self.chirp is not None:
+            # linear sweep, starting over every chirp_period seconds
+            (f0, f1) = self.chirp
+            tau = numpy.mod(t, self.chirp_period)
+            phase = f0*tau + (f1-f0)*tau**2/(2.0*self.chirp_period)
+            block += self.amplitude*numpy.sin(2*numpy.pi*phase)
+        if self.source_noise > 0:
+            # tones and chirps are too narrowband for GCC-PHAT to see the delay,
+            # noise from the source carries it across the whole band
+            source = numpy.concatenate((self.history, self.rng.normal(0, self.source_noise, length)))
+            self.history = source[-len(self.history):]
+            at = len(self.history) + numpy.arange(length)[:, None] - self.lags[None, :]
+            block += numpy.interp(at, numpy.arange(len(source)), source)
+        if self.noise > 0:
+            block += self.rng.normal(0, self.noise, block.shape)
+        return(block)
+
+class DaqSimulator(object):
+    def __init__(self, directory, generator, file_length_sec=1.0, block_sec=0.1, dropout=0.0, partial=0.0, truth=None):
+        super(DaqSimulator, self).__init__()
+        self.directory = pathlib.Path(directory)
+        self.generator = generator
+        self.file_length_sec = file_length_sec
+        self.block_sec = block_sec
+        self.dropout = dropout
+        self.partial = partial
+        self.truth = pathlib.Path(truth) if truth is not None else self.directory / 'truth.csv'
+        self.sample_rate = generator.sample_rate
+        self.rng = numpy.random.default_rng()
+        # samples since the first file, keeps signals continuous across files
+        self.sample_index = 0
+
+    def log(self, log_file, name, start, finished, samples, status):
+        log_file.write('{},{:.6f},{:.6f},{},{}\n'.format(name, start, finished, samples, status))
+        log_file.flush()
+
+    def write_file(self, start, samples_per_file):
+        name = '{:.9f}.txt'.format(start)
+        # a partial file is abandoned somewhere between the first and last block
+        num_samples = samples_per_file
+        status = 'complete'
+        if self.rng.random() < self.partial:
+            num_samples = int(samples_per_file*self.rng.uniform(0.1, 0.9))
+            status = 'partial'
+        block_len = max(1, int(self.block_sec*self.sample_rate))
+        next_block = start
+        written = 0
+        with open(str(self.directory / name), 'w') as f:
+            while written < num_samples:
+                length = min(block_len, num_samples-written)
+                # the DAQ can't write samples before they were taken
+                next_block += length/self.sample_rate
+                time.sleep(max(0, next_block-time.time()))
+                numpy.savetxt(f, self.generator.block(self.sample_index+written, length), fmt='%.6f', delimiter=', ')
+                f.flush()
+                written += length
+        self.sample_index += samples_per_file
+        # an abandoned file still takes up its slot in time
+        time.sleep(max(0, start+self.file_length_sec-time.time()))
+        return(name, written, status)
+
+    def run(self, num_files=None):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        samples_per_file = int(self.sample_rate*self.file_length_sec)
+        count = 0
+        with open(str(self.truth), 'w') as log_file:
+            log_file.write(','.join(truth_columns) + '\n')
+            start = time.time()
+            while num_files is None or count < num_files:
+                if self.rng.random() < self.dropout:
+                    # nothing written for a whole file length
+                    time.sleep(max(0, start+self.file_length_sec-time.time()))
+                    self.sample_index += samples_per_file
+                    self.log(log_file, '{:.9f}.txt'.format(start), start, time.time(), 0, 'dropout')
+                else:
+                    (name, written, status) = self.write_file(start, samples_per_file)
+                    self.log(log_file, name, start, time.time(), written, status)
+                start += self.file_length_sec
+                count += 1
+
+def read_truth(path):
+    truth = {}
+    with open(str(path)) as f:
+        next(f)
+        for line in f:
+            (name, start, finished, samples, status) = line.strip().split(',')
+            truth[name] = (float(start), float(finished), int(samples), status)
+    return(truth)
+
+def measure(source, sample_rate, file_length_sec, nfft, duration, poll_sec=0.01):
+    # same file picking as the viewer, minus curses; a file counts as shown
+    # once its spectra are ready to draw
+    ui = Ui(0, 0, time.time(), None, 0, 0, sample_rate, file_length_sec=file_length_sec)
+    shown = {}
+    end = time.time()+duration
+    while time.time() < end:
+        if len(ui.get_files(source)) > 2:
+            file = ui.get_file(None, source)
+            if file.name not in shown:
+                samples = read_data_file(file)
+                spectra_db(frame_spectra(samples[:, 0], nfft, int(sample_rate*file_length_sec)))
+                shown[file.name] = time.time()
+                continue
+        time.sleep(poll_sec)
+    return(shown, ui.latency.dropped, ui.latency.incomplete)
+
+def report(truth, shown, ui_dropped, ui_incomplete):
+    names = sorted(truth)
+    # the viewer never streams the oldest file or the newest one (it may
+    # still be written), so those can't count against it
+    written = [name for name in names if truth[name][3] != 'dropout']
+    expected = [name for name in written[1:-1] if truth[name][3] == 'complete']
+    lags = numpy.array([shown[name]-truth[name][1] for name in expected if name in shown])
+    missed = [name for name in expected if name not in shown]
+    partial_shown = [name for name in shown if name in truth and truth[name][3] == 'partial']
+    statuses = [truth[name][3] for name in names]
+    print('files: {} complete, {} partial, {} dropout'.format(
+        statuses.count('complete'), statuses.count('partial'), statuses.count('dropout')))
+    print('shown: {} of {} complete files, missed {} (Ui counted {} dropped, {} incomplete)'.format(
+        len(lags), len(expected), len(missed), ui_dropped, ui_incomplete))
+    if len(partial_shown) > 0:
+        print('partial files shown: {}'.format(len(partial_shown)))
+    if len(lags) > 0:
+        print('lag from finished to shown (s): mean {:.3f} p50 {:.3f} p95 {:.3f} max {:.3f}'.format(
+            lags.mean(), numpy.percentile(lags, 50), numpy.percentile(lags, 95), lags.max()))
+    for name in missed:
+        print('  missed {}'.format(name))
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate a DAQ writing uldaq text files in real time')
+    parser.add_argument('--output-dir', help='Directory the files are written to', required=False)
+    parser.add_argument('--sample-rate', help='', required=False, type=float)
+    parser.add_argument('--file-length', help='in seconds', required=False, type=float)
+    parser.add_argument('--channels', help='', required=False, type=int)
+    parser.add_argument('--num-files', help='Stop after this many files (default runs until Ctrl + C)', required=False, type=int)
+    parser.add_argument('--block', help='Seconds of samples written at a time', required=False, type=float)
+    parser.add_argument('--tones', help='Comma separated tone frequencies in Hz', required=False)
+    parser.add_argument('--chirp', help='Linear chirp start:end in Hz', required=False)
+    parser.add_argument('--chirp-period', help='Seconds per sweep', required=False, type=float)
+    parser.add_argument('--amplitude', help='Volts, for each tone and the chirp', required=False, type=float)
+    parser.add_argument('--noise', help='Standard deviation of white noise in volts', required=False, type=float)
+    parser.add_argument('--source-noise', help='Standard deviation of broadband noise from the source, delayed per channel like --bearing (default --amplitude with --bearing, otherwise 0)', required=False, type=float)
+    parser.add_argument('--bearing', help='Arrive as a plane wave from this many degrees off broadside', required=False, type=float)
+    parser.add_argument('--array-spacing', help='Meters between channels for --bearing', required=False, type=float)
+    parser.add_argument('--sound-speed', help='m/s for --bearing', required=False, type=float)
+    parser.add_argument('--dropout', help='Chance a file is never written (0..1)', required=False, type=float)
+    parser.add_argument('--partial', help='Chance a file is abandoned part way through (0..1)', required=False, type=float)
+    parser.add_argument('--truth', help='Ground truth CSV (default OUTPUT_DIR/truth.csv)', required=False)
+    parser.add_argument('--measure', help='Run a headless viewer on the files and report lag and missed files', action='store_true')
+    parser.add_argument('--nfft', help='NFFT used by the headless viewer', required=False, type=int)
+    parser.set_defaults(output_dir=os.path.join(os.getcwd(), 'simulated'),
+                        sample_rate=19200,
+                        file_length=1.0,
+                        channels=1,
+                        num_files=None,
+                        block=0.1,
+                        tones='2000',
+                        chirp=None,
+                        chirp_period=1.0,
+                        amplitude=0.002,
+                        noise=0.0005,
+                        source_noise=None,
+                        bearing=None,
+                        array_spacing=1.0,
+                        sound_speed=1500.0,
+                        dropout=0.0,
+                        partial=0.0,
+                        truth=None,
+                        nfft=240)
+    args = parser.parse_args()
+    if args.measure and args.num_files is None:
+        parser.error('--measure needs --num-files')
+
+    chirp = parse_list(args.chirp, sep=':') or None
+    source_noise = args.source_noise
+    if source_noise is None:
+        source_noise = args.amplitude if args.bearing is not None else 0.0
+    generator = SignalGenerator(args.sample_rate, args.channels, tones=parse_list(args.tones), chirp=chirp,
+        chirp_period=args.chirp_period, amplitude=args.amplitude, noise=args.noise, source_noise=source_noise, bearing=args.bearing,
+        array_spacing=args.array_spacing, sound_speed=args.sound_speed)
+    simulator = DaqSimulator(args.output_dir, generator, file_length_sec=args.file_length, block_sec=args.block,
+        dropout=args.dropout, partial=args.partial, truth=args.truth)
+    print('writing {} channel(s) at {}Hz into {}, Ctrl + C to stop'.format(args.channels, args.sample_rate, args.output_dir))
+    try:
+        if not args.measure:
+            simulator.run(args.num_files)
+            return
+        # the DAQ gets its own process so parsing doesn't slow the writing down
+        writer = multiprocessing.Process(target=simulator.run, args=(args.num_files,))
+        writer.start()
+        try:
+            shown, ui_dropped, ui_incomplete = measure(args.output_dir, args.sample_rate, args.file_length, args.nfft,
+                (args.num_files+1)*args.file_length)
+        finally:
+            writer.join()
+        report(read_truth(simulator.truth), shown, ui_dropped, ui_incomplete)
+    except KeyboardInterrupt:
+        print('\n\tExiting...\n\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -12,10 +12,69 @@
 #
 # File: specgram.py
 #
+from common import read_data_file, bearing_bar_width, zoom_taps_per_decimation
+from bearing import channel_pairs, gcc_phat, line_array_bearing
 import numpy
 import math
+import time
 import curses
 
+def frame_spectra(samples, nfft, num_samples=None, step=1):
+    # split (..., samples) into back to back frames of nfft and fft every step'th one
+    # returns (..., frames, nfft/2) complex bins
+    samples = numpy.asarray(samples)
+    if num_samples is None:
+        num_samples = samples.shape[-1]
+    num_frames = int(min(samples.shape[-1], num_samples)/nfft)
+    frames = samples[..., :num_frames*nfft].reshape(samples.shape[:-1]+(num_frames, nfft))
+    return(numpy.fft.rfft(frames[..., ::step, :], axis=-1)[..., :int(nfft/2)])
+
+def frame_rms(samples, nfft, num_frames, step=1):
+    # RMS voltage of the first num_frames (every step'th) frames, one reduction over the matrix
+    samples = numpy.asarray(samples)
+    total = min(int(samples.shape[-1]/nfft), (num_frames-1)*step+1) if num_frames > 0 else 0
+    frames = samples[..., :total*nfft].reshape(samples.shape[:-1]+(total, nfft))[..., ::step, :]
+    return(numpy.sqrt(numpy.mean(numpy.square(frames, dtype=float), axis=-1)))
+
+def zoom_filter(decimation):
+    # windowed-sinc lowpass passing 1/decimation of the band around DC, unity gain
+    taps = zoom_taps_per_decimation*decimation+1
+    n = numpy.arange(taps)-(taps-1)/2.0
+    h = numpy.sinc(n/decimation)*numpy.hamming(taps)
+    return(h/h.sum())
+
+def zoom_spectra(samples, nfft, zoom, center, sample_rate, num_samples=None, step=1):
+    # nfft/2 bins spanning sample_rate/(2*zoom) around center, each frame
+    # covers nfft*zoom samples -> (frames, nfft/2) complex bins
+    samples = numpy.asarray(samples, dtype=float)
+    if num_samples is None:
+        num_samples = samples.shape[-1]
+    decimation = 2*zoom
+    bins = int(nfft/2)
+    frame_len = nfft*zoom
+    num_frames = int(min(samples.shape[-1], num_samples)/frame_len)
+    h = zoom_filter(decimation)
+    pad = int((len(h)-1)/2)
+    # shifting the filter up to the band instead of the samples down to DC
+    # means only the decimated outputs get mixed and the dot product stays real
+    w = 2*numpy.pi*center/sample_rate
+    bandpass = h*numpy.exp(-1j*w*(numpy.arange(len(h))-pad))
+    # the filter is centered so rows line up in time
+    padded = numpy.concatenate((numpy.zeros(pad), samples[:num_frames*frame_len], numpy.zeros(pad)))
+    # (frames, bins, taps) view, only the samples we keep after decimating are filtered
+    stride = padded.strides[0]
+    windows = numpy.lib.stride_tricks.as_strided(padded, shape=(num_frames, bins, len(h)),
+        strides=(stride*frame_len, stride*decimation, stride), writeable=False)[::step]
+    filtered = windows.dot(numpy.stack((bandpass.real, bandpass.imag), axis=1))
+    outputs = numpy.arange(0, num_frames, step)[:, None]*bins + numpy.arange(bins)[None, :]
+    baseband = (filtered[..., 0] + 1j*filtered[..., 1])*numpy.exp(-1j*w*decimation*outputs)
+    # x2 puts a tone at the same level as the one sided full band spectrum
+    return(numpy.fft.fftshift(numpy.fft.fft(baseband, axis=-1)*2, axes=-1))
+
+def spectra_db(spectra):
+    # dB re 1uPa, empty bins (dropouts) are floored at 0dB instead of -inf
+    return(20*numpy.log10(numpy.maximum(numpy.abs(spectra), pow(10,-6))/pow(10,-6)))
+
 class Specgram(object):
     def __init__(self, sample_rate, 
                        file_length_sec, 
@@ -28,7 +87,9 @@ class Specgram(object):
                        voltage_bar_width,
                        device_name=None, 
                        v_min=-1, 
-                       v_max=1):
+                       v_max=1,
+                       array_spacing=1.0,
+                       sound_speed=1500.0):
         super(Specgram, self).__init__()
         self.sample_rate=sample_rate
         self.file_length_sec=file_length_sec
@@ -40,6 +101,8 @@ class Specgram(object):
         self.nfft=nfft
         self.max_lines=max_lines
         self.line_mod=1
+        self.row_step=1       # > 1 draws fewer rows to keep up (see realtime.py)
+        self.frame_step=1     # > 1 only takes the fft of every frame_step'th frame
         self.lines_of_data=0
         self.calc_line_mod=True
         self.data=[]
@@ -48,6 +111,17 @@ class Specgram(object):
         self.voltage_bar_width=voltage_bar_width-2
         self.voltage_range=[v_min, v_max]
         self.raw_voltages=[]
+        self.show_bearing=False
+        self.bearing_bar_width=bearing_bar_width-10 # room for the +00.0deg label
+        self.array_spacing=array_spacing
+        self.sound_speed=sound_speed
+        self.all_samples=None
+        self.bearings=None
+        self.remote_fdb=None
+        self.remote_rms=None
+        self.last_fdb=None
+        self.markind=0
+        self.zoom=1           # > 1 shows 1/zoom of the band around markfreq with zoom x finer bins
         self.argmax_freq = 0.0
         self.device_name = device_name
         self.dev_name_color = 100
@@ -56,99 +130,141 @@ class Specgram(object):
     def clear(self):
         self.data = []
         self.raw_voltages = []
+        self.all_samples = None
+        self.bearings = None
+        self.remote_fdb = None
+        self.remote_rms = None
+        self.last_fdb = None
 
     def pop_voltage_bar(self, voltages):
-        self.voltage_range[0]=min(voltages)
-        self.voltage_range[1]=max(voltages)
+        voltages=numpy.asarray(voltages, dtype=float)
+        mask=numpy.full((len(voltages), self.voltage_bar_width), ' ')
+        if len(voltages) == 0:
+            return(mask)
+        self.voltage_range[0]=voltages.min()
+        self.voltage_range[1]=voltages.max()
         step=abs(self.voltage_range[1]-self.voltage_range[0])/float(self.voltage_bar_width)
-        mask= [[' ']*self.voltage_bar_width]*len(voltages)
-        for row in range(0, len(voltages)):
-            v=self.voltage_range[0]
-            for col in range(0, self.voltage_bar_width):
-                if voltages[row]<=v and ('.' not in mask[row]):
-                    mask[row][col]='.'
-                v+=step
+        mask[:, int(self.voltage_bar_width/2)]='|'
+        # first column whose voltage is >= the row's RMS voltage gets the dot
+        if step > 0:
+            cols=numpy.ceil((voltages-self.voltage_range[0])/step).astype(int)
+        else:
+            cols=numpy.zeros(len(voltages), dtype=int)
+        # column 0 is hidden under the separator, the loudest row lands on the last column
+        cols=numpy.clip(cols, 1, self.voltage_bar_width-1)
+        mask[numpy.arange(len(voltages)), cols]='.'
         return(mask)
 
     def parse_file(self, file):
-        with open(str(file)) as f:
-            self.clear()
-            for i, line in enumerate(f):
-                voltages = line.split(',')
-
-                if len(voltages) <= self.display_channel:
-                    self.display_channel = 0
-
-                try:
-                    self.data.append(float(voltages[self.display_channel]))
-                except ValueError:
-                    continue
-                except IndexError as e:
-                    raise Exception(' *index={}, len(voltages)={}'.format(self.display_channel, len(voltages)))
-                else:
-                    self.raw_voltages.append(self.data[-1])
+        self.clear()
+        if hasattr(file, 'read_channel'):
+            # archive entries hand back a memory mapped slice of one channel
+            if file.num_channels <= self.display_channel:
+                self.display_channel = 0
+            self.data = file.read_channel(self.display_channel)
+            self.raw_voltages = self.data
+            if self.show_bearing:
+                self.all_samples = numpy.stack([file.read_channel(c) for c in range(0, file.num_channels)])
             return True
+        # plain or compressed text files are streamed through the bulk parser
+        samples = read_data_file(file)
+        if samples.shape[1] <= self.display_channel:
+            self.display_channel = 0
+        self.data = samples[:, self.display_channel]
+        self.raw_voltages = self.data
+        self.all_samples = samples.T
+        return True
+
+    def zoom_center(self):
+        # keep the whole band between DC and nyquist
+        half_band = self.sample_rate/(4.0*self.zoom)
+        return(min(max(self.markfreq, half_band), self.sample_rate/2.0-half_band))
+
+    def frequencies(self):
+        # frequency of each displayed column
+        bins = numpy.arange(int(self.nfft/2))
+        if self.zoom > 1:
+            return(self.zoom_center() + (bins-int(self.nfft/4))*self.sample_rate/float(self.nfft*self.zoom))
+        return(bins*self.sample_rate/float(self.nfft))
+
+    def compute_spectra(self):
+        num_samples = int(self.sample_rate*self.file_length_sec)
+        self.bearings = None
+        if self.zoom > 1:
+            # band limited, the bearing panel only works on full band spectra
+            fdb = spectra_db(zoom_spectra(self.data, self.nfft, self.zoom, self.zoom_center(),
+                self.sample_rate, num_samples, step=self.frame_step))
+        elif self.show_bearing and self.all_samples is not None and len(self.all_samples) > 1:
+            # one set of spectra for every channel feeds both the display and GCC-PHAT
+            spectra = frame_spectra(self.all_samples, self.nfft, num_samples, step=self.frame_step)
+            fdb = spectra_db(spectra[self.display_channel])
+            self.bearings = self.compute_bearings(spectra)
+        else:
+            fdb = spectra_db(frame_spectra(self.data, self.nfft, num_samples, step=self.frame_step))
+        frame_len = self.nfft*self.zoom
+        hop = frame_len*self.frame_step
+        indvec = list(start+frame_len/2 for start in range(0, len(fdb)*hop, hop))
+        return(indvec, fdb)
+
+    def compute_bearings(self, spectra):
+        pairs = channel_pairs(len(spectra))
+        # a pair can't be further apart in time than its baseline allows
+        max_tdoa = (len(spectra)-1)*self.array_spacing/float(self.sound_speed)
+        (tdoa, peak) = gcc_phat(spectra, pairs, self.sample_rate, self.nfft, max_tdoa=max_tdoa)
+        return(line_array_bearing(tdoa, peak, pairs, self.array_spacing, self.sound_speed))
+
+    def pop_bearing_bar(self, bearings):
+        # -90..+90 degrees across the bar, '*' at each row's bearing
+        width = self.bearing_bar_width
+        mask = numpy.full((len(bearings), width), ' ')
+        mask[:, int(width/2)] = '|'
+        cols = numpy.round((numpy.asarray(bearings)+90.0)/180.0*(width-1)).astype(int)
+        mask[numpy.arange(len(bearings)), numpy.clip(cols, 0, width-1)] = '*'
+        return(mask)
+
+    def load_spectra(self, spectra, rms_voltages, nfft, sample_rate):
+        # spectra (channels, frames, bins) in dB and rms (channels, frames) that were computed by the daemon
+        if spectra.shape[0] <= self.display_channel:
+            self.display_channel = 0
+        self.nfft = nfft
+        self.sample_rate = sample_rate
+        # the daemon only sends full band spectra
+        self.zoom = 1
+        self.remote_fdb = spectra[self.display_channel]
+        self.remote_rms = rms_voltages[self.display_channel]
+
+    def colorize(self, fdb):
+        # distance of each bin from the threshold -> color pair for that cell
+        level = numpy.trunc(fdb).astype(int) - self.threshdb
+        steps = self.threshdb_steps
+        return(numpy.select([(level >= 0) & (level <= steps), # closest to thresh
+                             (level >= 0) & (level < steps*2), # inbetween closest and max
+                             level >= 0,                      # loudest
+                             -level <= steps,                 # close to thresh
+                             -level < steps*2],               # inbetween
+                            [curses.COLOR_YELLOW,
+                             curses.COLOR_MAGENTA,
+                             curses.COLOR_RED,
+                             curses.COLOR_GREEN,
+                             curses.COLOR_CYAN],
+                            curses.COLOR_BLUE))               # quietest
 
     def getFFTs(self):
-        atend=False
-        
-        start=0
-        strvec=[]
-        indvec=[]
-        rms_voltages=[]
         self.argmax_freq=0.0
-        while not atend:
-            curvec=self.data[start:start+self.nfft]
-            if len(curvec) == 0: 
-                break
-
-            #take fft
-            fvec=numpy.fft.fft(curvec)
-            try:
-                fdb = list(20*math.log(abs(x)/pow(10,-6),10) for x in fvec[0:int(self.nfft/2)])
-            except ValueError as e:
-                print('Caught ValueError! Most likely bad data...\n{}'.format(e))
-                with open('/cli-log.txt'.format(os.getcwd()), 'a+') as f:
-                    f.write('Voltage that threw Exception: {}\n{}\n'.format(v, e))
-                # import ipdb; ipdb.set_trace() # BREAKPOINT
-                return(None, None, None)
-
-            self.argmax_freq=fdb.index(max(fdb))
-            line=''
-            for f in fdb:
-                if int(f)>=self.threshdb:
-                    if int(f)-self.threshdb <= self.threshdb_steps:     # closest to thresh
-                        line+=str(curses.COLOR_YELLOW)
-                    elif int(f)-self.threshdb < self.threshdb_steps*2: # inbetween closest and max
-                        line+=str(curses.COLOR_MAGENTA)
-                    elif int(f)-self.threshdb >= self.threshdb_steps*2:   # loudest
-                        line+=str(curses.COLOR_RED)
-                else:
-                    if self.threshdb-int(f) <= self.threshdb_steps:     # close to thresh
-                        line+=str(curses.COLOR_GREEN)
-                    elif self.threshdb-int(f) < self.threshdb_steps*2: # inbewtween 
-                        line+=str(curses.COLOR_CYAN)
-                    elif self.threshdb-int(f) >= self.threshdb_steps*2:   # quietest
-                        line+=str(curses.COLOR_BLUE)
-
-            strvec.append(line)
-            indvec.append(start+self.nfft/2)
-            # calc RMS voltage for this line
-            line_rms_voltage=0
-            snapshot_rms=self.raw_voltages[start:start+self.nfft]
-            # calc square
-            for v in snapshot_rms:
-                line_rms_voltage+=v**2
-            # calc mean, then root
-            rms_voltages.append(round(math.sqrt(line_rms_voltage/len(fdb)),6))
-
-            start=start+self.nfft
-            if start > (self.sample_rate*self.file_length_sec)-self.nfft:
-                atend=True
-
-        #self.argmax_freq=math.sqrt(self.argmax_freq/self.nfft)
-
-        return (indvec, strvec, rms_voltages)
+        if self.remote_fdb is not None:
+            fdb = self.remote_fdb
+            rms_voltages = self.remote_rms
+            indvec = list(start+self.nfft/2 for start in range(0, len(fdb)*self.nfft, self.nfft))
+        else:
+            (indvec, fdb) = self.compute_spectra()
+            # RMS voltage for each line
+            rms_voltages = numpy.round(frame_rms(self.raw_voltages, self.nfft*self.zoom, len(fdb), step=self.frame_step), 6)
+
+        if len(fdb) > 0:
+            self.argmax_freq=int(numpy.argmax(fdb[-1]))
+        self.last_fdb = fdb
+
+        return (indvec, self.colorize(fdb), rms_voltages)
 
     def add_intensity_bar(self, window, y,x):
         window.addstr(y,x,'Quietest         Loudest')
@@ -164,34 +280,34 @@ class Specgram(object):
         return(y+3,x)
 
     def display(self, stdscr):
-        if len(self.data) <= 0:
+        if len(self.data) <= 0 and self.remote_fdb is None:
             stdscr.addstr('parse data from file first!')
             return
         # take fft of the channel data:
         (indvec, strout, rms_voltages) = self.getFFTs()
-        if (indvec == None or strout == None):
+        if (indvec is None or strout is None):
             return
         ii=0
-        freqlist = numpy.fft.fftfreq(self.nfft)*self.sample_rate
-        maxfreq=freqlist[int(self.nfft/2-1)]
+        freqlist = self.frequencies()
+        df = freqlist[1]-freqlist[0]
+        maxfreq=freqlist[-1]
         minfreq=freqlist[1]
-        stdscr.addstr('df=' + str(minfreq))
-        stdscr.addstr(' maxfreq=' + str(maxfreq) + '\n')
+        stdscr.addstr('df=' + str(df))
+        if self.zoom > 1:
+            stdscr.addstr(' zoom=x{} band={}-{}Hz\n'.format(self.zoom, round(freqlist[0], 1), round(maxfreq, 1)))
+        else:
+            stdscr.addstr(' maxfreq=' + str(maxfreq) + '\n')
         stdscr.addstr(' NFFT=' + str(self.nfft) + '\n')
-        markdind=0
-        #get the index for markfreq
-        ind = 0
         # make sure we don't go off the end
         if self.markfreq > maxfreq:
             self.markfreq = maxfreq
         elif self.markfreq < minfreq:
             self.markfreq = minfreq
 
-        for f in freqlist:
-            if f > self.markfreq-freqlist[1]/2 and f <= self.markfreq+freqlist[1]/2:
-                self.markfreq = f
-                markind=ind
-            ind=ind+1
+        #get the index for markfreq
+        markind=int(numpy.argmin(numpy.abs(freqlist-self.markfreq)))
+        self.markfreq=freqlist[markind]
+        self.markind=markind
         
         strbord=''
         fbord=''
@@ -211,27 +327,36 @@ class Specgram(object):
         stdscr.addstr('time [s]')
         stdscr.addstr(fbord[1:] + '\n', curses.A_BOLD)
 
-        if False:#self.show_voltage:
-            stdscr.addstr('       ' +  strbord + ' - snapshot RMS voltage +\n')
-        else:
-            stdscr.addstr('       ' +  strbord + '\n')
+        stdscr.addstr('       ' +  strbord)
+        if self.show_voltage:
+            stdscr.addstr(' - snapshot RMS voltage +')
+        if self.show_bearing:
+            if self.bearings is not None:
+                stdscr.addstr('  bearing -90 | +90')
+            elif self.zoom > 1:
+                stdscr.addstr('  bearing off (zoomed)')
+            else:
+                stdscr.addstr('  bearing: 2+ channels')
+        stdscr.addstr('\n')
 
         ms_vec = list(int(float(x)/self.sample_rate*1000) for x in indvec)
 
         #
-        # if window was resized we need to recalculate the line mod
+        # if window was resized or the number of lines changed we need to recalculate the line mod
         #
-        if self.calc_line_mod:
+        if self.calc_line_mod or self.lines_of_data != len(strout):
             self.lines_of_data=len(strout)
             self.line_mod=1
-            while self.lines_of_data/self.line_mod > self.max_lines:
+            while self.lines_of_data/self.line_mod > max(self.max_lines/self.row_step, 1):
                 self.line_mod+=1
             self.calc_line_mod=False
         #
         # Display colors
         #
-        if False:#self.show_voltage:
+        if self.show_voltage:
             mask=self.pop_voltage_bar(rms_voltages)
+        if self.show_bearing and self.bearings is not None:
+            bearing_mask=self.pop_bearing_bar(self.bearings)
 
         for row, stro in enumerate(strout):
             if row%self.line_mod==0:
@@ -243,19 +368,45 @@ class Specgram(object):
                     else:
                         stdscr.addstr('|', self.color_pair(int(char)))
 
-                if False:#self.show_voltage:
+                if self.show_voltage:
                     stdscr.addstr('  ')
-                    col=0
-                    for col in range(1, self.voltage_bar_width):
-                        if mask[row][col]=='.':
-                            stdscr.addstr('.', self.color_pair(10) | curses.A_BOLD)
-                        elif col==self.voltage_bar_width/2:
-                            stdscr.addstr('|', self.color_pair(9))
-                        else:
-                            stdscr.addstr(' ', self.color_pair(9))
+                    (before, dot, after) = ''.join(mask[row, 1:]).partition('.')
+                    stdscr.addstr(before, self.color_pair(9))
+                    if dot:
+                        stdscr.addstr(dot, self.color_pair(10) | curses.A_BOLD)
+                        stdscr.addstr(after, self.color_pair(9))
+
+                if self.show_bearing and self.bearings is not None:
+                    stdscr.addstr('  {:+5.0f} '.format(self.bearings[row]))
+                    (before, star, after) = ''.join(bearing_mask[row]).partition('*')
+                    stdscr.addstr(before, self.color_pair(9))
+                    stdscr.addstr(star, self.color_pair(10) | curses.A_BOLD)
+                    stdscr.addstr(after, self.color_pair(9))
 
                 stdscr.addstr('\n')
             ii=ii+1
 
         stdscr.addstr('       ' +  strbord + '\n')
-        stdscr.addstr('       ' +  fbord + '\n', curses.A_BOLD)
\ No newline at end of file
+        stdscr.addstr('       ' +  fbord + '\n', curses.A_BOLD)
+
+    def display_ltsa(self, stdscr, ltsa, rows):
+        (epochs, fdb) = ltsa.compressed(rows)
+        stdscr.addstr('       LTSA ', curses.A_BOLD)
+        if self.zoom > 1:
+            # the columns are full band, they wouldn't line up with the zoomed view
+            stdscr.addstr('hidden while zoomed\n')
+            return
+        if len(fdb) == 0 or fdb.shape[1] != int(self.nfft/2):
+            stdscr.addstr('collecting, one average per {}\n'.format(ltsa.period))
+            return
+        stdscr.addstr('{} to {} ({} averages, one per {})\n'.format(
+            time.strftime('%H:%M', time.localtime(epochs[0])), 
+            time.strftime('%H:%M', time.localtime(epochs[-1])), ltsa.count, ltsa.period))
+        for epoch, row in zip(epochs, self.colorize(fdb)):
+            stdscr.addstr(time.strftime(' %H:%M', time.localtime(epoch)) + '| ')
+            for col, char in enumerate(row):
+                if col!=self.markind:
+                    stdscr.addstr(' ', self.color_pair(int(char)))
+                else:
+                    stdscr.addstr('|', self.color_pair(int(char)))
+            stdscr.addstr('\n')
@@ -0,0 +1,121 @@
+# GNU LESSER GENERAL PUBLIC LICENSE
+#    Version 2.1, February 1999
+#
+# See LICENSE
+#
+# Copyright (c) 2020 Caileigh F
+#
+# Woods Hole Oceanographic Institution
+# Author: Caileigh Fitzgerald
+# Email:  cfitzgerald@whoi.edu
+# Date:   03/04/2020
+#
+# File: spectra_pool.py
+#
+# Spreads the spectral stage over worker processes. Samples are copied once
+# into shared memory, each worker computes a block of frames for one channel
+# and writes its dB rows into a shared output array. With one process (or no
+# shared memory support) everything runs inline.
+#
+from specgram import frame_spectra, spectra_db
+from shm_ring import attach, shared_memory
+import math
+import numpy
+import multiprocessing
+from multiprocessing import resource_tracker
+
+# shared memory blocks each worker has attached, by name
+worker_blocks = {}
+
+def worker_arrays(*blocks):
+    # (name, shape) pairs -> arrays over the parent's shared memory
+    names = [name for (name, shape) in blocks]
+    for old in list(worker_blocks):
+        if old not in names:
+            # the parent made new blocks, let go of the old ones
+            worker_blocks.pop(old).close()
+    for name in names:
+        if name not in worker_blocks:
+            # forked workers share the parent's resource tracker, which unlinks the blocks
+            worker_blocks[name] = shared_memory.SharedMemory(name=name)
+    return([numpy.ndarray(shape, dtype=float, buffer=worker_blocks[name].buf) for (name, shape) in blocks])
+
+def spectra_task(task):
+    (in_name, in_shape, out_name, out_shape, channel, first, last, nfft) = task
+    (samples, fdb) = worker_arrays((in_name, in_shape), (out_name, out_shape))
+    fdb[channel, first:last] = spectra_db(frame_spectra(samples[channel, first*nfft:last*nfft], nfft))
+    return(channel, first, last)
+
+class SpectraPool(object):
+    def __init__(self, processes=1):
+        super(SpectraPool, self).__init__()
+        if shared_memory is None:
+            processes = 1
+        self.processes = max(1, int(processes))
+        self.pool = None
+        if self.processes > 1:
+            # start the tracker first so the workers share it instead of each
+            # starting their own (which would unlink our blocks when they exit)
+            resource_tracker.ensure_running()
+            self.pool = multiprocessing.Pool(self.processes)
+        self.inputs = None
+        self.outputs = None
+
+    def block(self, current, size):
+        # reuse the shared block unless it's too small
+        if current is not None and current.size >= size:
+            return(current)
+        if current is not None:
+            current.close()
+            current.unlink()
+        return(attach(None, create=True, size=max(size, 1)))
+
+    def spectra_db(self, samples, nfft, num_samples=None, step=1):
+        # same result as spectra_db(frame_spectra(...)) for (samples) or (channels, samples)
+        samples = numpy.asarray(samples)
+        if self.pool is None:
+            return(spectra_db(frame_spectra(samples, nfft, num_samples, step=step)))
+
+        squeeze = samples.ndim == 1
+        if squeeze:
+            samples = samples[None, :]
+        if num_samples is None:
+            num_samples = samples.shape[-1]
+        channels = samples.shape[0]
+        num_frames = int(min(samples.shape[-1], num_samples)/nfft)
+        if step > 1:
+            # only the frames we keep go to the workers
+            samples = samples[:, :num_frames*nfft].reshape(channels, num_frames, nfft)[:, ::step]
+            num_frames = samples.shape[1]
+            samples = samples.reshape(channels, num_frames*nfft)
+        bins = int(nfft/2)
+        in_shape = (channels, num_frames*nfft)
+        out_shape = (channels, num_frames, bins)
+
+        self.inputs = self.block(self.inputs, channels*num_frames*nfft*8)
+        self.outputs = self.block(self.outputs, channels*num_frames*bins*8)
+        numpy.ndarray(in_shape, dtype=float, buffer=self.inputs.buf)[:] = samples[:, :num_frames*nfft]
+
+        # split by channel, then by frame blocks so every worker gets a couple of tasks
+        blocks_per_channel = max(1, int(math.ceil(2.0*self.processes/channels)))
+        step = max(1, int(math.ceil(num_frames/float(blocks_per_channel))))
+        tasks = [(self.inputs.name, in_shape, self.outputs.name, out_shape, channel, first, min(first+step, num_frames), nfft)
+                 for channel in range(0, channels) for first in range(0, num_frames, step)]
+        self.pool.map(spectra_task, tasks)
+
+        fdb = numpy.ndarray(out_shape, dtype=float, buffer=self.outputs.buf).copy()
+        if squeeze:
+            return(fdb[0])
+        return(fdb)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        for block in (self.inputs, self.outputs):
+            if block is not None:
+                block.close()
+                block.unlink()
+        self.inputs = None
+        self.outputs = None
@@ -12,7 +12,9 @@
 #
 # File: ui.py
 #
-from common import voltage_bar_width, menu_row_buffer, extra_column_buffer, ESC, SHIFT_UP, SHIFT_DOWN, unix_epoch_to_local
+from common import voltage_bar_width, bearing_bar_width, menu_row_buffer, extra_column_buffer, ESC, SHIFT_UP, SHIFT_DOWN, ZOOM_IN, ZOOM_OUT, max_zoom, param_coalesce_sec, complete_file_fraction, unix_epoch_to_local, glob_data_files, open_data_file, data_file_stem
+from archive import Archive
+from realtime import LatencyBudget
 import os
 import numpy
 import math
@@ -23,7 +25,7 @@ import curses
 
 class Ui(object):
     def __init__(self, min_width, min_height, current_time, color_pair, max_rows_specgram, 
-        max_rows_specgram_no_menu, sample_rate, message_buffer_display_limit=3, mode='text', file_length_sec=1):
+        max_rows_specgram_no_menu, sample_rate, message_buffer_display_limit=3, mode='text', file_length_sec=1, ltsa_rows=8, realtime_policy=None):
         super(Ui, self).__init__()
         self.min_width = min_width
         self.min_height = min_height
@@ -53,6 +55,17 @@ class Ui(object):
         self.sample_rate = sample_rate
         self.file_length_sec = file_length_sec
         self.files_in_tstep = self.get_num_files_in_min()
+        self.archive = None
+        self.pending_nfft = None
+        self.pending_resize = False
+        self.fixed_nfft = False # nfft comes from the daemon with --connect
+        self.last_param_change = 0
+        self.show_voltage = False
+        self.show_ltsa = False
+        self.ltsa_rows = ltsa_rows
+        self.ltsa_pane_rows = ltsa_rows # what's left of ltsa_rows after the terminal height
+        self.last_streamed = None
+        self.latency = LatencyBudget(file_length_sec, realtime_policy)
 
     def get_num_files_in_min(self):
         if self.file_length_sec >= 1:
@@ -66,11 +79,16 @@ class Ui(object):
         self.specgram_max_lines = max_rows_specgram
         self.specgram_max_lines_no_menu = max_rows_specgram_no_menu
         self.hide_menu = False
-        specgram.max_lines=self.specgram_max_lines
-        # next display will recalc line mod   
-        specgram.calc_line_mod=True
+        self.show_ltsa = False
+        self.update_max_lines(specgram)
+        if self.show_voltage:
+            self.min_width-=voltage_bar_width
         specgram.show_voltage=False
         self.show_voltage=False
+        if specgram.show_bearing:
+            self.min_width-=bearing_bar_width
+        specgram.show_bearing=False
+        specgram.zoom=1
         self.hide_debugger=False
         self.num_resets+=1
 
@@ -86,11 +104,19 @@ class Ui(object):
     def get_files(self, source):
         if self.mode=='binary':
             return(sorted(pathlib.Path(source).glob('1*.bin')))
+        elif Archive.is_archive(source):
+            # packed archive, entries stand in for the files
+            if self.archive is None or self.archive.path != pathlib.Path(source):
+                self.archive = Archive(source)
+            return(self.archive.entries())
         else:
-            return(sorted(pathlib.Path(source).glob('*.txt')))
+            return(glob_data_files(source))
 
     def is_valid_file(self, file):
-        num_lines = sum(1 for line in open(file))
+        if hasattr(file, 'read_channel'):
+            return(file.length == int(self.sample_rate * self.file_length_sec))
+        with open_data_file(file) as f:
+            num_lines = sum(1 for line in f)
         valid_num_lines = int(self.sample_rate * self.file_length_sec)
         return(num_lines == valid_num_lines)
 
@@ -146,21 +172,57 @@ class Ui(object):
                     self.current_file = files[pos]
 
         if self.stop_at_file:
+            # skipping files on purpose isn't dropping them
+            self.last_streamed = None
             # make sure user doesn't go to last file because it's empty
-            if os.path.getsize(str(self.current_file)) <= 0:
+            if self.get_file_size(self.current_file) <= 0:
                 self.reset_nav()
                 self.current_file=files[-2] # set to most recent file
         else:
             if self.is_valid_file(files[-2]):
-                self.current_file=files[-2]
+                newest=files[-2]
             else:
-                self.current_file=files[-3]
+                newest=files[-3]
+            self.count_dropped(files, newest)
+            self.current_file=newest
 
         if self.current_file != files[1]:
             self.show_we_skipped_to_beginning = False
 
         return(self.current_file)
 
+    def count_dropped(self, files, newest):
+        # files between the last one we streamed and the newest were never drawn
+        if self.last_streamed is not None and self.last_streamed != newest:
+            try:
+                skipped = files[files.index(self.last_streamed)+1:files.index(newest)]
+            except ValueError:
+                skipped = []
+            reference_size = self.get_file_size(newest)
+            for file in skipped:
+                # short files are skipped on purpose, they're a DAQ fault not lag
+                try:
+                    valid = self.looks_complete(file, reference_size)
+                except OSError:
+                    valid = False
+                if valid:
+                    self.latency.dropped += 1
+                else:
+                    self.latency.incomplete += 1
+        self.last_streamed = newest
+
+    def looks_complete(self, file, reference_size):
+        # is_valid_file reads the whole file, too slow when we're already behind
+        if hasattr(file, 'read_channel'):
+            return(self.is_valid_file(file))
+        # text line lengths vary a little with signs and digits, short files are well under
+        return(self.get_file_size(file) >= complete_file_fraction*reference_size)
+
+    def get_file_size(self, file):
+        if hasattr(file, 'read_channel'):
+            return(file.length)
+        return(os.path.getsize(str(file)))
+
     def handle_no_files(self, window, source):
         files = self.get_files(source)
         while len(files) <= 2:
@@ -205,16 +267,29 @@ class Ui(object):
         # now add the number of new lines to max
         self.specgram_max_lines += num_new_lines
         self.specgram_max_lines_no_menu += num_new_lines
+        self.update_max_lines(specgram)
+
+        return(nfft)
+
+    def update_max_lines(self, specgram):
         # find out if we are in full screen or not
         if self.hide_menu:
             specgram.max_lines=self.specgram_max_lines_no_menu
         else:
             specgram.max_lines=self.specgram_max_lines
+        # the LTSA pane takes its rows plus a title line from the spectrogram,
+        # shrinking so at least one spectrogram row is left
+        if self.show_ltsa:
+            self.ltsa_pane_rows = min(self.ltsa_rows, specgram.max_lines-2)
+            if self.ltsa_pane_rows < 1:
+                self.show_ltsa = False
+                self.message_buffer.append('No room for the LTSA')
+            else:
+                specgram.max_lines-=self.ltsa_pane_rows+1
+        specgram.max_lines = max(specgram.max_lines, 1)
         # next display will recalc line mod   
         specgram.calc_line_mod=True
 
-        return(nfft)
-
     def toggle(self, state):
         if state:
             return False
@@ -222,28 +297,36 @@ class Ui(object):
 
     def handle_key_strokes(self, window, specgram):
         self.current_time=time.time()
-        temp_nfft = None
         while (self.current_time-self.start) <= specgram.file_length_sec:
             key = window.getch()
             if key != -1:
                 with open('cli-log.txt', 'a+') as f:
                     f.write('[{}]: Key: {}\n'.format(time.time(), key))
             if key == curses.KEY_RESIZE:
-                temp_nfft = self.handle_resize(window, specgram, specgram.nfft)
+                self.pending_resize = True
+                self.last_param_change = self.current_time
             elif key == curses.KEY_UP:
                 specgram.threshdb+=1
             elif key == curses.KEY_DOWN:
                 specgram.threshdb-=1
-            elif key == SHIFT_UP:
-                temp_nfft = specgram.nfft
-                temp_nfft += 10
-            elif key == SHIFT_DOWN:
-                temp_nfft = specgram.nfft
-                temp_nfft -= 10
+            elif (key == SHIFT_UP or key == SHIFT_DOWN) and not self.fixed_nfft:
+                # held keys only queue the change, it's applied once they settle
+                if self.pending_nfft is None:
+                    self.pending_nfft = specgram.nfft
+                if key == SHIFT_UP:
+                    self.pending_nfft += 10
+                else:
+                    self.pending_nfft -= 10
+                self.last_param_change = self.current_time
+            elif key == ZOOM_IN:
+                self.set_zoom(specgram, specgram.zoom*2)
+            elif key == ZOOM_OUT:
+                self.set_zoom(specgram, int(specgram.zoom/2))
             elif key == curses.KEY_RIGHT:
-                specgram.markfreq+=200
+                # finer steps when zoomed so the marker stays in the band
+                specgram.markfreq+=200.0/specgram.zoom
             elif key == curses.KEY_LEFT:
-                specgram.markfreq-=200
+                specgram.markfreq-=200.0/specgram.zoom
             elif key == curses.KEY_PPAGE:
                 self.nav_next_file=True
                 self.stop_at_file=True
@@ -272,24 +355,32 @@ class Ui(object):
                 self.skip_to_beginning = True
                 self.stop_at_file=True
             elif key == ord('V') or key == ord('v'):
-                pass
-                # if specgram.show_voltage:
-                #     self.show_voltage=False
-                #     specgram.show_voltage=False
-                #     self.min_width-=voltage_bar_width
-                # else:
-                #     self.show_voltage=True
-                #     specgram.show_voltage=True
-                #     self.min_width+=voltage_bar_width
+                if specgram.show_voltage:
+                    self.show_voltage=False
+                    specgram.show_voltage=False
+                    self.min_width-=voltage_bar_width
+                else:
+                    self.show_voltage=True
+                    specgram.show_voltage=True
+                    self.min_width+=voltage_bar_width
+                # make sure the bar still fits
+                self.pending_resize = True
             elif key == ord('F') or key == ord('f'):
-                if self.hide_menu:
-                    specgram.max_lines=self.specgram_max_lines
-                    self.hide_menu=False
+                self.hide_menu ^= True # will toggle
+                self.update_max_lines(specgram)
+            elif key == ord('G') or key == ord('g'):
+                # GCC-PHAT bearing panel
+                if specgram.show_bearing:
+                    specgram.show_bearing=False
+                    self.min_width-=bearing_bar_width
                 else:
-                    specgram.max_lines=self.specgram_max_lines_no_menu
-                    self.hide_menu=True
-                # next display will recalc line mod   
-                specgram.calc_line_mod=True
+                    specgram.show_bearing=True
+                    self.min_width+=bearing_bar_width
+                # make sure the panel still fits
+                self.pending_resize = True
+            elif key == ord('L') or key == ord('l'):
+                self.show_ltsa ^= True # will toggle
+                self.update_max_lines(specgram)
             elif key == ord('D') or key == ord('d'):
                 self.hide_debugger ^= True # will toggle 
                 # next display will recalc line mod   
@@ -298,23 +389,56 @@ class Ui(object):
             if key != -1:
                 self.key_id=key
 
-            if temp_nfft != None:
-                # next display will recalc line mod   
-                if temp_nfft > 500: 
-                    temp_nfft = 500
-
-                if temp_nfft < 10:
-                    temp_nfft = 10
-
-                self.min_width = int(temp_nfft/2)+extra_column_buffer
-                if self.min_width > self.current_width:
-                    temp_nfft = self.handle_resize(window, specgram, temp_nfft)
-                specgram.nfft = temp_nfft
+            self.current_time=time.time()
+            if self.current_time-self.last_param_change >= param_coalesce_sec:
+                self.apply_pending_params(window, specgram)
+        # anything still queued is applied before the next display
+        self.apply_pending_params(window, specgram)
+        self.start=self.current_time
 
+    def apply_pending_params(self, window, specgram):
+        # handle_resize sets specgram.nfft itself, compare against what it was before
+        previous_nfft = specgram.nfft
+        temp_nfft = self.pending_nfft
+        if self.pending_resize:
+            if self.fixed_nfft:
+                # wait for a big enough terminal, nfft stays as the daemon sent it
+                temp_nfft = self.handle_resize(window, specgram)
+            else:
+                temp_nfft = self.handle_resize(window, specgram, specgram.nfft if temp_nfft is None else temp_nfft)
+        self.pending_nfft = None
+        self.pending_resize = False
+        if temp_nfft is None:
+            return
+
+        if temp_nfft > 500: 
+            temp_nfft = 500
+
+        if temp_nfft < 10:
+            temp_nfft = 10
+
+        self.min_width = int(temp_nfft/2)+extra_column_buffer
+        if self.show_voltage:
+            self.min_width += voltage_bar_width
+        if specgram.show_bearing:
+            self.min_width += bearing_bar_width
+        if self.min_width > self.current_width:
+            temp_nfft = self.handle_resize(window, specgram, temp_nfft)
+        specgram.nfft = temp_nfft
+        # a longer nfft might not leave room for the zoom
+        self.set_zoom(specgram, specgram.zoom)
+        if temp_nfft != previous_nfft:
+            # next display will recalc line mod   
             specgram.calc_line_mod=True
 
-            self.current_time=time.time()
-        self.start=self.current_time
+    def set_zoom(self, specgram, zoom):
+        zoom = min(max(zoom, 1), max_zoom)
+        # each row needs nfft*zoom samples, keep at least one row per file
+        while zoom > 1 and specgram.nfft*zoom > self.sample_rate*self.file_length_sec:
+            zoom = int(zoom/2)
+        if zoom != specgram.zoom:
+            specgram.zoom = zoom
+            specgram.calc_line_mod=True
 
     def spin(self, window, specgram):
         self.current_height, self.current_width = window.getmaxyx()
@@ -338,14 +462,16 @@ class Ui(object):
         else:
             window.addstr(str(is_dup))
         window.addstr('\n file: ')
-        window.addstr(str(self.current_file.stem+'.txt'), curses.A_BOLD)
+        window.addstr(str(self.current_file.name), curses.A_BOLD)
         window.addstr('\n time: ')
         try:
-            window.addstr(str(unix_epoch_to_local(float(self.current_file.stem)))) # timestamp in filename converted to local time
+            window.addstr(str(unix_epoch_to_local(float(data_file_stem(self.current_file))))) # timestamp in filename converted to local time
         except: # if file name isn't a timestamp or timestamp isn't formatted correctly, don't display time
             pass
         window.addstr('\n -----------------------------')
         window.addstr('\n refresh count: %s'%(str(count)))
+        if not self.stop_at_file:
+            window.addstr('\n %s'%(self.latency.status()))
         # self.message_buffer.append('Key ID:   %s'%str(self.key_id))
         # self.message_buffer.append('Line mod: %s'%str(specgram.line_mod))
         self.message_buffer.append('max_rows:   {}, rows_shown: {}/{}'.format(specgram.lines_of_data, specgram.lines_of_data, specgram.line_mod))
@@ -27,6 +27,10 @@ setuptools.setup(
     entry_points={
         'console_scripts': [
         'cli_spectrogram = cli_spectrogram.cli_spectrogram:main',
+        'cli_spectrogram_archive = cli_spectrogram.archive:main',
+        'cli_spectrogram_daemon = cli_spectrogram.daemon:main',
+        'cli_spectrogram_shm_writer = cli_spectrogram.shm_ring:main',
+        'cli_spectrogram_simulator = cli_spectrogram.simulator:main',
         ],
     },
 )